@@ -0,0 +1,22 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'created')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
+    actions = ('retry',)
+    empty_value_display = '-пусто-'
+
+    def retry(self, request, queryset):
+        updated = queryset.update(status=Job.QUEUED, attempts=0, locked_at=None,
+                                  run_at=timezone.now())
+        self.message_user(request, f'Поставлено в очередь заново: {updated}')
+
+    retry.short_description = 'Повторить выбранные задачи'
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,56 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from jobs.queue import claim, run_job
+
+
+def run_in_worker(job_id):
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задачи из очереди в пуле потоков или процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Пул процессов вместо пула потоков')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['processes']:
+            # Дочерние процессы не должны делить соединения с родителем,
+            # поэтому они запускаются (при первом submit) до первого claim().
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+            pool.submit(close_old_connections).result()
+        else:
+            pool = ThreadPoolExecutor(workers)
+        done = failed = 0
+        try:
+            with pool:
+                while True:
+                    claimed = claim(workers * 2)
+                    if not claimed:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+                    finished, _ = wait([pool.submit(run_in_worker, job_id) for job_id in claimed])
+                    results = [future.result() for future in finished]
+                    done += results.count(True)
+                    failed += results.count(False)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}, с ошибкой: {failed}'))
@@ -0,0 +1,32 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DEAD = 'dead'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DEAD, 'Не выполнена'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('run_at',)
+        indexes = [
+            models.Index(fields=('status', 'run_at'), name='job_status_run_at'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
@@ -0,0 +1,125 @@
+"""
+Очередь фоновых задач в базе данных.
+
+Задача - функция, зарегистрированная декоратором @task. enqueue() кладёт
+её вызов в таблицу Job, а команда run_jobs выбирает и выполняет задачи.
+Успешные задачи удаляются, упавшие повторяются с экспоненциальной
+задержкой, а после max_attempts попыток остаются со статусом dead.
+"""
+import inspect
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        func.task_name = task_name
+        func.takes_using = 'using' in inspect.signature(func).parameters
+        func.max_attempts = max_attempts or settings.JOBS_MAX_ATTEMPTS
+        registry[task_name] = func
+        return func
+
+    return register(func) if func is not None else register
+
+
+def enqueue(func, delay=0, using=None, **kwargs):
+    """
+    Ставит вызов func(**kwargs) в очередь, когда зафиксирована текущая
+    транзакция базы using (по умолчанию основной), где изменены данные
+    задачи: воркер не увидит задачу раньше данных, а откаченная транзакция
+    задачу не ставит. Задача с параметром using получает эту базу.
+    При JOBS_EAGER задача в этот момент выполняется сразу, что удобно в
+    тестах и при отладке.
+    """
+    if using is not None and func.takes_using:
+        kwargs['using'] = using
+
+    def push():
+        if settings.JOBS_EAGER:
+            func(**kwargs)
+            return
+        Job.objects.create(
+            name=func.task_name,
+            payload=json.dumps(kwargs),
+            max_attempts=func.max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+    transaction.on_commit(push, using=using)
+
+
+def backoff(attempts):
+    return min(settings.JOBS_BACKOFF_BASE * 2 ** (attempts - 1), settings.JOBS_BACKOFF_MAX)
+
+
+def claim(limit):
+    """
+    Забирает до limit готовых задач. Задача захватывается условным
+    UPDATE, поэтому два воркера не выполнят её дважды. Задачи воркера,
+    упавшего посреди работы, через JOBS_LOCK_TIMEOUT снова доступны.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    # Задача, которая раз за разом роняет воркер, не должна повторяться вечно.
+    Job.objects.filter(status=Job.RUNNING, locked_at__lt=stale,
+                       attempts__gte=F('max_attempts')).update(
+        status=Job.DEAD, last_error='Воркер не завершил задачу за JOBS_LOCK_TIMEOUT')
+    ready = (Q(status=Job.QUEUED, run_at__lte=now)
+             | Q(status=Job.RUNNING, locked_at__lt=stale, attempts__lt=F('max_attempts')))
+    claimed = []
+    for job in Job.objects.filter(ready).only('status', 'locked_at')[:limit]:
+        won = (Job.objects
+               .filter(pk=job.pk, status=job.status, locked_at=job.locked_at)
+               .update(status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1))
+        if won:
+            claimed.append(job.pk)
+    return claimed
+
+
+def run_job(job_id):
+    """
+    Выполняет захваченную задачу. Возвращает True при успехе.
+    """
+    job = Job.objects.get(pk=job_id)
+    func = registry.get(job.name)
+    try:
+        if func is None:
+            raise LookupError(f'Неизвестная задача {job.name}')
+        func(**json.loads(job.payload))
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Задача %s исчерпала попытки:\n%s', job, error)
+            Job.objects.filter(pk=job.pk).update(status=Job.DEAD, last_error=error)
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, last_error=error, locked_at=None,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            )
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def run_pending(limit=100):
+    """
+    Выполняет готовые задачи в текущем потоке, возвращает их число.
+    """
+    claimed = claim(limit)
+    for job_id in claimed:
+        run_job(job_id)
+    return len(claimed)
@@ -0,0 +1,117 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import claim, enqueue, run_pending, task
+from yatube.testing import ImmediateOnCommit
+
+calls = []
+
+
+@task
+def remember(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def explode():
+    raise ValueError('boom')
+
+
+@task
+def remember_using(value, using):
+    calls.append((value, using))
+
+
+@override_settings(JOBS_EAGER=False)
+class TestQueue(ImmediateOnCommit, TestCase):
+    def setUp(self) -> None:
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        enqueue(remember, value=1)
+        enqueue(remember, value=2, delay=60)
+        self.assertEqual(calls, [])
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_claimed_job_not_claimed_twice(self):
+        enqueue(remember, value=1)
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+
+    def test_retry_with_backoff_then_dead(self):
+        enqueue(explode)
+        job = Job.objects.get()
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+        self.assertEqual(run_pending(), 0)
+
+    def test_stale_job_dead_after_max_attempts(self):
+        enqueue(explode)
+        stale = timezone.now() - timedelta(hours=1)
+        Job.objects.update(status=Job.RUNNING, attempts=2, locked_at=stale)
+        self.assertEqual(claim(10), [])
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.DEAD)
+        self.assertIn('JOBS_LOCK_TIMEOUT', job.last_error)
+
+    def test_enqueue_waits_for_given_database(self):
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            enqueue(remember, value=1, using='other')
+            enqueue(remember_using, value=2, using='other')
+        self.assertEqual([c.kwargs for c in on_commit.call_args_list],
+                         [{'using': 'other'}, {'using': 'other'}])
+        for call in on_commit.call_args_list:
+            call.args[0]()
+        self.assertEqual([json.loads(job.payload) for job in Job.objects.order_by('pk')],
+                         [{'value': 1}, {'value': 2, 'using': 'other'}])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        enqueue(remember, value=3)
+        self.assertEqual(calls, [3])
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(JOBS_EAGER=False)
+class TestWorker(TransactionTestCase):
+    # Воркеры работают в своих потоках и соединениях с базой.
+    def test_run_jobs_command(self):
+        calls.clear()
+        for value in range(5):
+            enqueue(remember, value=value)
+        out = StringIO()
+        call_command('run_jobs', once=True, workers=2, stdout=out)
+        self.assertEqual(sorted(calls), list(range(5)))
+        self.assertIn('Выполнено задач: 5', out.getvalue())
+        self.assertFalse(Job.objects.exists())
+
+    def test_enqueue_waits_for_commit(self):
+        with transaction.atomic():
+            enqueue(remember, value=1)
+            self.assertFalse(Job.objects.exists())
+        self.assertEqual(Job.objects.count(), 1)
+        try:
+            with transaction.atomic():
+                enqueue(remember, value=2)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Job.objects.count(), 1)
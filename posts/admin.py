@@ -1,21 +1,140 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+from django.db import connections
 
-from .models import Group, Post
+from . import moderation
+from .models import Comment, Follow, Group, Post
+from .paginators import EstimatedCountPaginator
+from .shards import is_sharded, sharding_enabled
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список без лишних COUNT(*): оценка числа строк и без подсчёта
+    полного размера таблицы при фильтрации.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
+
+    def cross_shard_relations(self):
+        if not (sharding_enabled() and is_sharded(self.model)):
+            return ()
+        return tuple(name for name in self.list_select_related
+                     if not is_sharded(self.model._meta.get_field(name).related_model))
+
+    def get_list_select_related(self, request):
+        # JOIN между шардом и основной базой невозможен: такие связи
+        # подгружаются отдельным запросом в get_queryset.
+        skipped = self.cross_shard_relations()
+        return tuple(name for name in self.list_select_related if name not in skipped)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        skipped = self.cross_shard_relations()
+        return queryset.prefetch_related(*skipped) if skipped else queryset
+
+
+class GroupActionForm(ActionForm):
+    group = forms.ModelChoiceField(Group.objects.only('title'), required=False,
+                                   label='Сообщество')
+
+
+def selected_group(request):
+    try:
+        return GroupActionForm.base_fields['group'].clean(request.POST.get('group'))
+    except ValidationError:
+        return None
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ('text', 'pub_date', 'author', 'pk')
+    list_select_related = ('author',)
     search_fields = ('text',)
+    # Ссылки фильтра - готовые диапазоны по индексу pub_date. Иерархии по
+    # дате нет: она перебирает даты всей таблицы на каждой странице списка.
     list_filter = ('pub_date',)
-    empty_value_display = '-пусто-'
+    raw_id_fields = ('author', 'group')
+    action_form = GroupActionForm
+    actions = ('move_to_group', 'delete_spam')
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Стандартное удаление загружает каждую запись и её комментарии.
+        actions.pop('delete_selected', None)
+        return actions
+
+    def move_to_group(self, request, queryset):
+        group = selected_group(request)
+        if group is None:
+            self.message_user(request, 'Выберите сообщество, в которое перенести',
+                              messages.ERROR)
+            return
+        moved = moderation.move_posts(queryset, group)
+        self.message_user(request, f'Перенесено записей: {moved}', messages.SUCCESS)
+
+    move_to_group.short_description = 'Перенести в выбранное сообщество'
+
+    def delete_spam(self, request, queryset):
+        deleted = moderation.delete_posts(queryset)
+        self.message_user(request, f'Удалено записей: {deleted}', messages.SUCCESS)
+
+    delete_spam.short_description = 'Удалить как спам вместе с комментариями'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or connections[queryset.db].vendor != 'postgresql':
+            return super().get_search_results(request, queryset, search_term)
+        # Выражение совпадает с GIN-индексом post_text_search.
+        queryset = queryset.extra(
+            where=["to_tsvector('russian', posts_post.text) @@ plainto_tsquery('russian', %s)"],
+            params=[search_term],
+        )
+        return queryset, False
 
 
 admin.site.register(Post, PostAdmin)
 
 
 class GroupAdmin(admin.ModelAdmin):
-    list_display = ('title',)
+    list_display = ('title', 'post_count')
     empty_value_display = '-пусто-'
+    action_form = GroupActionForm
+    actions = ('merge_into_group',)
+
+    def merge_into_group(self, request, queryset):
+        target = selected_group(request)
+        if target is None:
+            self.message_user(request, 'Выберите сообщество, в которое объединить',
+                              messages.ERROR)
+            return
+        moved = moderation.merge_groups(queryset, target)
+        self.message_user(request, f'Сообщества объединены в «{target}», '
+                                   f'перенесено записей: {moved}', messages.SUCCESS)
+
+    merge_into_group.short_description = 'Объединить в выбранное сообщество'
 
 
 admin.site.register(Group, GroupAdmin)
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('text', 'created', 'author', 'post')
+    list_select_related = ('author', 'post')
+    search_fields = ('text',)
+    raw_id_fields = ('author', 'post')
+
+
+admin.site.register(Comment, CommentAdmin)
+
+
+class FollowAdmin(LargeTableAdmin):
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    # Точное совпадение имени ищется по индексу, а не через LIKE.
+    search_fields = ('=user__username', '=author__username')
+    raw_id_fields = ('user', 'author')
+
+
+admin.site.register(Follow, FollowAdmin)
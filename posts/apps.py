@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from . import signals  # noqa
+        # Сброс кэша flatpages должен срабатывать и вне веб-процесса.
+        from yatube import flatpages  # noqa
@@ -0,0 +1,128 @@
+"""
+Холодный архив записей.
+
+Записи старше ARCHIVE_AFTER_DAYS вместе с комментариями переносятся
+в таблицы ArchivedPost и ArchivedComment того же шарда, поэтому индексы
+горячих таблиц остаются небольшими. Перенос идёт пачками: каждая пачка -
+INSERT ... SELECT и DELETE в одной короткой транзакции. Все архивные
+записи старше горячих, так что ленты показывают сначала горячие записи,
+а на дальних страницах продолжают архивными.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import ArchivedComment, ArchivedPost, Comment, Post, TrendingPost
+from .moderation import MODERATION_CHUNK_SIZE, delete_rows, post_chunks
+from .paginators import (FEED_COUNT_TIMEOUT, archive_changed, archive_generation, cached_count,
+                         feed_generations)
+
+# Архив меняется только командой archive_posts и модерацией, поэтому его
+# размер можно долго держать в кэше.
+ARCHIVE_COUNT_TIMEOUT = 60 * 60
+
+
+class TieredPosts:
+    """
+    Последовательность для Paginator: горячие записи, за ними архивные.
+    Размеры обеих частей берутся из кэша. scopes - ленты (feeds_changed),
+    при изменении которых размер горячей части надо пересчитать.
+    """
+    ordered = True
+
+    def __init__(self, hot, cold, scopes=('all',)):
+        self.hot = hot
+        self.cold = cold
+        self.scopes = scopes
+        self._hot_count = None
+
+    def hot_count(self):
+        if self._hot_count is None:
+            prefix = f'feed_count:{archive_generation()}:{feed_generations(self.scopes)}'
+            self._hot_count = cached_count(self.hot, prefix, FEED_COUNT_TIMEOUT)
+        return self._hot_count
+
+    def cold_count(self):
+        return cached_count(self.cold, f'archive_count:{archive_generation()}',
+                            ARCHIVE_COUNT_TIMEOUT)
+
+    def count(self):
+        return self.hot_count() + self.cold_count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        hot_count = self.hot_count()
+        items = list(self.hot[start:stop]) if start < hot_count else []
+        if stop is None or stop > hot_count:
+            cold_stop = None if stop is None else stop - hot_count
+            items += list(self.cold[max(start - hot_count, 0):cold_stop])
+        return items
+
+
+def tiered_posts(scope='all', **lookups):
+    return TieredPosts(Post.objects.filter(**lookups).for_list(),
+                       ArchivedPost.objects.filter(**lookups).for_list(), (scope,))
+
+
+def copy_rows(alias, source, target, column, values):
+    """
+    Копирует строки source в target одним INSERT ... SELECT внутри базы.
+    """
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in target._meta.concrete_fields)
+    placeholders = ', '.join(['%s'] * len(values))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(target._meta.db_table)} ({columns}) '
+            f'SELECT {columns} FROM {quote(source._meta.db_table)} '
+            f'WHERE {quote(column)} IN ({placeholders})',
+            values,
+        )
+
+
+def _move(queryset, target, comment_source, comment_target, chunk_size, progress):
+    source = queryset.model
+    moved = 0
+    for alias, pks in post_chunks(queryset, chunk_size):
+        with transaction.atomic(using=alias):
+            copy_rows(alias, source, target, 'id', pks)
+            copy_rows(alias, comment_source, comment_target, 'post_id', pks)
+            comment_source.objects.using(alias).filter(post_id__in=pks).delete()
+            if source is Post:
+                TrendingPost.objects.using(alias).filter(post_id__in=pks).delete()
+            # Запись не удаляется, а переезжает вместе с картинкой, поэтому
+            # сигналы удаления не нужны, а ленты сбросит archive_changed().
+            moved += delete_rows(alias, source, pks)
+        if progress:
+            progress(moved)
+    if moved:
+        archive_changed()
+    return moved
+
+
+def archive_posts(days=None, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Переносит в архив записи старше days дней.
+    """
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return _move(Post.objects.filter(pub_date__lt=cutoff), ArchivedPost,
+                 Comment, ArchivedComment, chunk_size, progress)
+
+
+def restore_posts(days=None, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Возвращает из архива записи новее days дней, при days=None - все.
+    """
+    queryset = ArchivedPost.objects.all()
+    if days is not None:
+        queryset = queryset.filter(pub_date__gte=timezone.now() - timedelta(days=days))
+    return _move(queryset, Post, ArchivedComment, Comment, chunk_size, progress)
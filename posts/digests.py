@@ -0,0 +1,105 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import DigestRun, Follow, Post, User
+
+# Сколько записей одного автора показывать в письме.
+POSTS_PER_AUTHOR = 5
+
+
+def current_run():
+    """
+    Незавершённая рассылка или новая, начиная с конца предыдущей.
+    """
+    run = DigestRun.objects.filter(finished__isnull=True).first()
+    if run is not None:
+        return run
+    now = timezone.now()
+    last = DigestRun.objects.first()
+    since = last.until if last else now - timedelta(hours=settings.DIGEST_PERIOD_HOURS)
+    return DigestRun.objects.create(since=since, until=now)
+
+
+def follower_chunks(cursor, chunk_size):
+    """
+    Подписчики пачками по возрастанию id, начиная после cursor.
+    """
+    while True:
+        follower_ids = list(Follow.objects.filter(user_id__gt=cursor)
+                            .order_by('user_id').values_list('user_id', flat=True)
+                            .distinct()[:chunk_size])
+        if not follower_ids:
+            return
+        yield follower_ids
+        cursor = follower_ids[-1]
+
+
+def new_posts_by_author(author_ids, run):
+    """
+    Не больше POSTS_PER_AUTHOR свежих записей и их общее число на автора.
+    """
+    posts = defaultdict(list)
+    totals = defaultdict(int)
+    new_posts = (Post.objects.filter(author_id__in=author_ids,
+                                     pub_date__gte=run.since, pub_date__lt=run.until)
+                 .order_by('-pub_date').only('author_id', 'text', 'pub_date'))
+    for post in new_posts.iterator():
+        totals[post.author_id] += 1
+        if len(posts[post.author_id]) < POSTS_PER_AUTHOR:
+            posts[post.author_id].append(post)
+    return posts, totals
+
+
+def send_digests(chunk_size=1000, progress=None):
+    """
+    Рассылает дайджест подписчикам пачками. Память ограничена одной
+    пачкой подписчиков и их авторов, после каждой пачки позиция
+    сохраняется в DigestRun.
+    """
+    run = current_run()
+    body_template = get_template('email/digest.txt')
+    author_template = get_template('email/digest_author.txt')
+    for follower_ids in follower_chunks(run.cursor, chunk_size):
+        follows = defaultdict(list)
+        for user_id, author_id in (Follow.objects.filter(user_id__in=follower_ids)
+                                   .order_by('author_id').values_list('user_id', 'author_id')):
+            follows[user_id].append(author_id)
+        author_ids = {author_id for authors in follows.values() for author_id in authors}
+        posts, totals = new_posts_by_author(author_ids, run)
+        usernames = dict(User.objects.filter(pk__in=list(posts)).values_list('pk', 'username'))
+        # Блок автора одинаков для всех его подписчиков: рендерим его один раз.
+        sections = {
+            author_id: author_template.render({
+                'username': usernames[author_id],
+                'posts': author_posts,
+                'more': totals[author_id] - len(author_posts),
+                'site_url': settings.SITE_URL,
+            })
+            for author_id, author_posts in posts.items()
+        }
+        messages = []
+        recipients = (User.objects.filter(pk__in=follower_ids, is_active=True)
+                      .exclude(email='').only('username', 'email'))
+        for recipient in recipients:
+            recipient_sections = [sections[author_id] for author_id in follows[recipient.pk]
+                                  if author_id in sections]
+            if not recipient_sections:
+                continue
+            body = body_template.render({'user': recipient, 'sections': recipient_sections})
+            messages.append(EmailMessage(settings.DIGEST_SUBJECT, body, to=[recipient.email]))
+        if messages:
+            with get_connection() as connection:
+                connection.send_messages(messages)
+        DigestRun.objects.filter(pk=run.pk).update(
+            cursor=follower_ids[-1], sent=F('sent') + len(messages))
+        if progress:
+            progress(follower_ids[-1], len(messages))
+    DigestRun.objects.filter(pk=run.pk).update(finished=timezone.now())
+    run.refresh_from_db()
+    return run
@@ -0,0 +1,175 @@
+"""
+Уведомления о новых записях для открытых лент.
+
+Каждая новая запись увеличивает версии каналов 'all', 'author:<id>'
+и 'group:<id>'. Страница ленты передаёт время своей отрисовки (since),
+а поток событий (или долгий опрос) ждёт смены версии своих каналов
+и только тогда считает в базе, сколько записей новее since.
+
+LocalBus хранит версии в памяти процесса и подходит для одного процесса
+и тестов. CacheBus держит версии в общем кэше, поэтому видит записи из
+всех процессов. Кэш опрашивает один поток на процесс - раз в
+EVENTS_POLL_INTERVAL и одним get_many по всем каналам, которые кто-то
+ждёт, - и будит ожидающих через общий Condition. Записи своего процесса
+будят их сразу.
+
+Под WSGI каждый открытый поток событий всё же занимает поток сервера,
+поэтому процесс держит не больше EVENTS_MAX_STREAMS потоков событий
+(см. streams), остальным браузерам отвечает сразу.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+# Комментарий-пинг не даёт прокси закрыть молчащее соединение.
+EVENTS_KEEPALIVE = 15
+# Через сколько миллисекунд браузер переподключается к потоку.
+EVENTS_RETRY = 2000
+# То же, когда процесс уже держит EVENTS_MAX_STREAMS потоков событий.
+EVENTS_BUSY_RETRY = 30000
+
+
+def post_channels(post):
+    channels = ['all', f'author:{post.author_id}']
+    if post.group_id:
+        channels.append(f'group:{post.group_id}')
+    return channels
+
+
+class StreamSlots:
+    """
+    Счётчик открытых потоков событий процесса.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.open >= settings.EVENTS_MAX_STREAMS:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.open -= 1
+
+
+streams = StreamSlots()
+
+
+class LocalBus:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = {}
+
+    def publish(self, channels):
+        with self.condition:
+            self.store(channels)
+            self.condition.notify_all()
+
+    def store(self, channels):
+        for channel in channels:
+            self.versions[channel] = self.versions.get(channel, 0) + 1
+
+    def versions_of(self, channels):
+        return {channel: self.versions.get(channel, 0) for channel in channels}
+
+    def wait(self, channels, known, timeout):
+        """
+        Ждёт не дольше timeout секунд, пока версии каналов не отличатся
+        от known, и возвращает текущие версии.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                current = {channel: self.versions.get(channel, 0) for channel in channels}
+                remaining = deadline - time.monotonic()
+                if current != known or remaining <= 0:
+                    return current
+                self.condition.wait(remaining)
+
+
+class CacheBus(LocalBus):
+    """
+    self.versions - копия версий из кэша для каналов, которые ждут
+    (watched), её обновляет поток poller.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.poll_interval = settings.EVENTS_POLL_INTERVAL
+        self.watched = {}
+        self.poller = None
+
+    @staticmethod
+    def key(channel):
+        return f'events:{channel}'
+
+    def store(self, channels):
+        for channel in channels:
+            key = self.key(channel)
+            cache.add(key, 0, None)
+            try:
+                version = cache.incr(key)
+            except ValueError:
+                version = 1
+                cache.set(key, version, None)
+            if channel in self.watched:
+                self.versions[channel] = version
+
+    def versions_of(self, channels):
+        values = cache.get_many([self.key(channel) for channel in channels])
+        return {channel: values.get(self.key(channel), 0) for channel in channels}
+
+    def wait(self, channels, known, timeout):
+        with self.condition:
+            missing = [channel for channel in channels if channel not in self.watched]
+            for channel in channels:
+                self.watched[channel] = self.watched.get(channel, 0) + 1
+            # После fork поток опроса родителя в процессе не существует.
+            if self.poller is None or not self.poller.is_alive():
+                self.poller = threading.Thread(target=self.poll, name='events-poller',
+                                               daemon=True)
+                self.poller.start()
+        if missing:
+            fresh = self.versions_of(missing)
+            with self.condition:
+                for channel, version in fresh.items():
+                    self.versions.setdefault(channel, version)
+        try:
+            return super().wait(channels, known, timeout)
+        finally:
+            with self.condition:
+                for channel in channels:
+                    self.watched[channel] -= 1
+                    if not self.watched[channel]:
+                        del self.watched[channel]
+                        self.versions.pop(channel, None)
+
+    def poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.condition:
+                channels = list(self.watched)
+                if not channels:
+                    self.poller = None
+                    return
+            fresh = self.versions_of(channels)
+            with self.condition:
+                changed = False
+                for channel, version in fresh.items():
+                    if channel in self.watched and self.versions.get(channel) != version:
+                        self.versions[channel] = version
+                        changed = True
+                if changed:
+                    self.condition.notify_all()
+
+
+bus = SimpleLazyObject(lambda: import_string(settings.EVENTS_BUS)())
@@ -1,12 +1,39 @@
 from django import forms
+from django.urls import reverse_lazy
 
-from .models import Comment, Post
+from .models import Comment, Group, Post
+
+FOLLOW_IMPORT_LIMIT = 5000
+
+
+class GroupAutocompleteWidget(forms.Widget):
+    """
+    Поле ввода названия с подсказками из group_lookup вместо списка
+    всех сообществ. Выбранный id передаётся в скрытом поле.
+    """
+    template_name = 'posts/widgets/group_autocomplete.html'
+    lookup_url = reverse_lazy('group_lookup')
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        title = ''
+        if context['widget']['value']:
+            try:
+                title = (Group.objects.filter(pk=context['widget']['value'])
+                         .values_list('title', flat=True).first()) or ''
+            except ValueError:
+                pass
+        context['widget'].update(title=title, lookup_url=self.lookup_url)
+        return context
 
 
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image', )
+        widgets = {
+            'group': GroupAutocompleteWidget,
+        }
 
         required = {
             'group': False,
@@ -17,8 +44,30 @@ class PostForm(forms.ModelForm):
             'group': 'Выбор группы',
         }
 
+    def clean(self):
+        # Слишком большой файл записан на диск не целиком, и ImageField
+        # считает его битым: показываем настоящую причину.
+        error = getattr(self.files.get('image'), 'upload_error', None)
+        if error:
+            self.errors.pop('image', None)
+            self.add_error('image', error)
+        return super().clean()
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ('text',)
+
+
+class FollowImportForm(forms.Form):
+    authors = forms.CharField(widget=forms.Textarea,
+                              help_text='Имена авторов через пробел или с новой строки')
+
+    def clean_authors(self):
+        usernames = self.cleaned_data['authors'].split()
+        if len(usernames) > FOLLOW_IMPORT_LIMIT:
+            raise forms.ValidationError(
+                f'За один раз можно подписаться не более чем на {FOLLOW_IMPORT_LIMIT} авторов'
+            )
+        return usernames
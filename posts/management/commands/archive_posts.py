@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.archival import archive_posts, restore_posts
+from posts.moderation import MODERATION_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Переносит записи старше --days дней с комментариями в архивные таблицы, '
+            'с --restore возвращает из архива записи новее --days дней')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--restore', action='store_true',
+                            help='Вернуть записи из архива')
+        parser.add_argument('--all', action='store_true',
+                            help='Вместе с --restore: вернуть весь архив')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['all'] and not options['restore']:
+            raise CommandError('--all используется только вместе с --restore')
+
+        def progress(done):
+            self.stdout.write(f'Перенесено: {done}')
+
+        if options['restore']:
+            days = None if options['all'] else options['days']
+            moved = restore_posts(days, options['chunk_size'], progress)
+            self.stdout.write(self.style.SUCCESS(f'Возвращено из архива: {moved}'))
+        else:
+            moved = archive_posts(options['days'], options['chunk_size'], progress)
+            self.stdout.write(self.style.SUCCESS(f'Перенесено в архив: {moved}'))
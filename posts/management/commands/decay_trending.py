@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from posts.models import TrendingPost
+
+
+class Command(BaseCommand):
+    help = ('Затухание счёта популярных записей. Запускается периодически: '
+            'при запуске раз в час и --factor 0.5 вклад комментария '
+            'уменьшается вдвое каждый час.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factor', type=float, default=0.5)
+        parser.add_argument('--min-score', type=float, default=0.05,
+                            help='Записи с меньшим счётом убираются из популярного')
+
+    def handle(self, *args, **options):
+        TrendingPost.objects.update(score=F('score') * options['factor'])
+        removed, _ = TrendingPost.objects.filter(score__lt=options['min_score']).delete()
+        self.stdout.write(self.style.SUCCESS(f'Убрано из популярного: {removed}'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import ArchivedPost, Post, User
+from posts.moderation import MODERATION_CHUNK_SIZE, delete_posts
+
+
+class Command(BaseCommand):
+    help = 'Удаляет записи авторов-спамеров вместе с комментариями пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('authors', nargs='+', help='Имена авторов')
+        parser.add_argument('--contains', help='Удалить только записи с этим текстом')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        authors = dict(User.objects.filter(username__in=options['authors'])
+                       .values_list('username', 'pk'))
+        missing = set(options['authors']) - set(authors)
+        if missing:
+            raise CommandError(f'Пользователи не найдены: {", ".join(sorted(missing))}')
+
+        deleted = 0
+        for username, author_id in sorted(authors.items()):
+            # Спам мог уже уехать в архив.
+            for model in (Post, ArchivedPost):
+                queryset = model.objects.filter(author_id=author_id)
+                if options['contains']:
+                    queryset = queryset.filter(text__contains=options['contains'])
+                deleted += delete_posts(
+                    queryset, options['chunk_size'],
+                    progress=lambda done: self.stdout.write(f'{username}: удалено {done}'))
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей: {deleted}'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import User
+from posts.moderation import MODERATION_CHUNK_SIZE, deactivate_user, delete_user_content
+from users.backends import forget_user
+
+
+class Command(BaseCommand):
+    help = ('Удаляет пользователя со всеми записями: сразу скрывает его, '
+            'а данные удаляет пачками фоновой задачей')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--now', action='store_true',
+                            help='Удалить в этом процессе, а не через очередь задач')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'Пользователь {options["username"]} не найден')
+        if not options['now']:
+            deactivate_user(user)
+            self.stdout.write(self.style.SUCCESS(
+                f'Пользователь {user} скрыт, удаление поставлено в очередь'))
+            return
+
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        forget_user(user.pk)
+        delete_user_content(user.pk, options['chunk_size'], progress=lambda stage, done:
+                            self.stdout.write(f'{stage}: удалено {done}'))
+        self.stdout.write(self.style.SUCCESS(f'Пользователь {user} удалён'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает список авторов, на которых подписан пользователь'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', help='Файл для выгрузки, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["username"]} не найден')
+        usernames = Follow.objects.export(user).iterator()
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.writelines(f'{username}\n' for username in usernames)
+        else:
+            for username in usernames:
+                self.stdout.write(username)
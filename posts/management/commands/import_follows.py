@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = 'Подписывает пользователя на авторов из файла (по одному имени в строке)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('input', nargs='?', help='Файл со списком авторов, по умолчанию stdin')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["username"]} не найден')
+        if options['input']:
+            with open(options['input'], encoding='utf-8') as source:
+                usernames = source.read().split()
+        else:
+            usernames = sys.stdin.read().split()
+        before = user.follower.count()
+        Follow.objects.bulk_follow(user, usernames, batch_size=options['batch_size'])
+        added = user.follower.count() - before
+        self.stdout.write(self.style.SUCCESS(f'Добавлено подписок: {added}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Group
+from posts.moderation import MODERATION_CHUNK_SIZE, merge_groups
+
+
+class Command(BaseCommand):
+    help = 'Объединяет сообщества-дубликаты: переносит их записи в target и удаляет их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', help='slug сообщества, которое остаётся')
+        parser.add_argument('sources', nargs='+', help='slug сообществ-дубликатов')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        target = Group.objects.filter(slug=options['target']).first()
+        if target is None:
+            raise CommandError(f'Сообщество {options["target"]} не найдено')
+        sources = list(Group.objects.filter(slug__in=options['sources']))
+        missing = set(options['sources']) - {group.slug for group in sources}
+        if missing:
+            raise CommandError(f'Сообщества не найдены: {", ".join(sorted(missing))}')
+
+        moved = merge_groups(sources, target, options['chunk_size'],
+                             progress=lambda done: self.stdout.write(f'Перенесено: {done}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Объединено сообществ: {len(sources)}, перенесено записей: {moved}'))
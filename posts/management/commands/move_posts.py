@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Group, Post, User
+from posts.moderation import MODERATION_CHUNK_SIZE, move_posts
+
+
+def get_group(slug):
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        raise CommandError(f'Сообщество {slug} не найдено')
+    return group
+
+
+class Command(BaseCommand):
+    help = 'Переносит записи сообщества или автора в другое сообщество пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', help='slug сообщества, куда перенести записи; '
+                                           '"-" - убрать из сообщества')
+        parser.add_argument('--from-group', help='slug сообщества, откуда перенести')
+        parser.add_argument('--author', help='Перенести только записи этого автора')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if not options['from_group'] and not options['author']:
+            raise CommandError('Укажите --from-group или --author')
+        target = None if options['target'] == '-' else get_group(options['target'])
+        # Сообщества и пользователи лежат в основной базе, а записи могут быть
+        # на шардах, поэтому фильтруем по id, а не через join.
+        queryset = Post.objects.all()
+        if options['from_group']:
+            queryset = queryset.filter(group_id=get_group(options['from_group']).pk)
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'Пользователь {options["author"]} не найден')
+            queryset = queryset.filter(author_id=author.pk)
+
+        moved = move_posts(queryset, target, options['chunk_size'],
+                           progress=lambda done: self.stdout.write(f'Перенесено: {done}'))
+        self.stdout.write(self.style.SUCCESS(f'Перенесено записей: {moved}'))
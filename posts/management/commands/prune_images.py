@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import StoredImage
+from posts.storage import post_image_storage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет изображения, на которые больше не ссылается ни одна запись, и их миниатюры'
+
+    def add_arguments(self, parser):
+        # Только что загруженный файл получает ссылку чуть позже, чем попадает на диск.
+        parser.add_argument('--hours', type=int, default=1,
+                            help='Удалять файлы, оставшиеся без ссылок дольше стольких часов')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        deleted = 0
+        for image in StoredImage.objects.filter(refcount=0, updated__lt=cutoff).iterator():
+            # Строка удаляется первой: если на файл успели сослаться, он останется.
+            if not StoredImage.objects.filter(pk=image.pk, refcount=0).delete()[0]:
+                continue
+            default.kvstore.delete(ImageFile(image.name, post_image_storage))
+            post_image_storage.delete(image.name)
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено изображений: {deleted}'))
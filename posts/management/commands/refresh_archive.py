@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import ArchiveMonth, Group, User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает помесячный архив всех авторов и сообществ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, field in ((User, 'author_ids'), (Group, 'group_ids')):
+            ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(ids), batch_size):
+                ArchiveMonth.refresh(**{field: ids[start:start + batch_size]})
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {len(ids)}')
+        self.stdout.write(self.style.SUCCESS('Архив пересчитан'))
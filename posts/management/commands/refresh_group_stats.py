@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику всех сообществ для каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        group_ids = list(Group.objects.values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(group_ids), batch_size):
+            Group.refresh_stats(group_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено сообществ: {len(group_ids)}'))
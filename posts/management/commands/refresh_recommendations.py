@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.recommendations import refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рекомендации авторов по графу подписок. '
+            'По умолчанию обновляются только пользователи, чьи подписки '
+            'изменились, их подписчики и читатели общих авторов; --full '
+            'пересчитывает всех и должен запускаться по расписанию, '
+            'например раз в сутки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Сколько авторов рекомендовать каждому пользователю')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = refresh_recommendations(limit=options['limit'],
+                                          full=options['full'],
+                                          batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено пользователей: {updated}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import ArchivedPost, Post
+from posts.moderation import MODERATION_CHUNK_SIZE, post_chunks
+
+
+class Command(BaseCommand):
+    help = 'Готовит HTML текста и отрывки записей, сохранённых до их появления, пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Обработать заново все записи, а не только новые')
+        parser.add_argument('--chunk-size', type=int, default=MODERATION_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for model in (Post, ArchivedPost):
+            queryset = model.objects.all()
+            if not options['all']:
+                queryset = queryset.filter(text_html='')
+            rendered = 0
+            for alias, pks in post_chunks(queryset, options['chunk_size']):
+                posts = list(model.objects.using(alias).filter(pk__in=pks).only('text'))
+                for post in posts:
+                    post.render()
+                model.objects.using(alias).bulk_update(posts, ['text_html', 'excerpt'])
+                rendered += len(posts)
+                self.stdout.write(f'{model._meta.verbose_name_plural}: {rendered}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Обработано {model._meta.verbose_name_plural}: {rendered}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.digests import send_digests
+
+
+class Command(BaseCommand):
+    help = ('Рассылает подписчикам дайджест новых записей с прошлой рассылки. '
+            'Прерванная рассылка при следующем запуске продолжается с места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько подписчиков обрабатывать за один проход')
+
+    def handle(self, *args, **options):
+        def progress(cursor, sent):
+            self.stdout.write(f'Подписчики до id {cursor}: отправлено писем {sent}')
+
+        run = send_digests(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Дайджест {run}: отправлено писем {run.sent}'))
@@ -0,0 +1,189 @@
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (WSGIRequestHandler, WSGIServer,
+                                          get_internal_wsgi_application)
+from django.db import connections
+
+from yatube.warmup import warm_up
+
+# Воркер, упавший быстрее, перезапускается с паузой, чтобы не крутить fork.
+MIN_WORKER_LIFETIME = 1
+# Соединение keep-alive без запросов не держит поток пула дольше этого.
+KEEPALIVE_TIMEOUT = 5
+
+
+def process_age():
+    """
+    Секунды с запуска процесса: вместе с импортом Django и настройкой
+    приложений. Известно только в Linux, иначе 0.
+    """
+    try:
+        with open('/proc/self/stat') as stat, open('/proc/uptime') as uptime:
+            ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+            return float(uptime.read().split()[0]) - ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RequestHandler(WSGIRequestHandler):
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except socket.timeout:
+            self.close_connection = True
+            return
+        # При остановке соединение закрывается после текущего запроса.
+        if self.server.draining.is_set():
+            self.close_connection = True
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    Обрабатывает соединения в пуле из threads потоков: лишние ждут
+    в очереди, а не порождают новые потоки.
+    """
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = threads
+        self.pool = None
+        self.pending = set()
+        self.draining = threading.Event()
+
+    def serve_forever(self, poll_interval=0.5):
+        # Потоки не переживают fork, поэтому пул создаётся в воркере.
+        self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix='serve')
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        future = self.pool.submit(self.process_request_thread, request, client_address)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """
+        Вызывается после выхода из serve_forever: ждёт принятые соединения
+        не дольше timeout секунд. Возвращает, сколько из них не успело.
+        """
+        self.draining.set()
+        self.pool.shutdown(wait=False)
+        _, not_done = wait(set(self.pending), timeout)
+        return len(not_done)
+
+
+class Command(BaseCommand):
+    help = 'Загружает и прогревает приложение, затем запускает воркеры через fork'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1:8000', help='Адрес и порт, host:port')
+        parser.add_argument('--workers', type=int,
+                            default=settings.SERVE_WORKERS or 2 * (os.cpu_count() or 1) + 1,
+                            help='Число процессов-воркеров')
+        parser.add_argument('--threads', type=int, default=settings.SERVE_THREADS,
+                            help='Число потоков в воркере')
+        parser.add_argument('--check', action='store_true',
+                            help='Загрузить и прогреть приложение и завершиться')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('Команде serve нужен fork (Linux, macOS)')
+        started = time.monotonic() - process_age()
+        application = get_internal_wsgi_application()
+        self.stdout.write(f'Приложение загружено за {time.monotonic() - started:.2f} с')
+        for name, count, seconds in warm_up(application):
+            self.stdout.write(f'Прогрето {name}: {count} за {seconds:.2f} с')
+        if options['check']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Приложение готово за {time.monotonic() - started:.2f} с'))
+            return
+
+        host, _, port = options['bind'].rpartition(':')
+        host = host.strip('[]')
+        try:
+            server = PooledWSGIServer((host, int(port)), RequestHandler, ipv6=':' in host,
+                                      threads=options['threads'])
+        except (ValueError, OSError) as error:
+            raise CommandError(f'Не удалось открыть {options["bind"]}: {error}')
+        server.set_app(application)
+
+        # Соединения не переживают fork, а прогретые объекты Python
+        # исключаются из сборки мусора, чтобы воркеры не копировали их страницы.
+        connections.close_all()
+        for cache in caches.all():
+            cache.close()
+        gc.collect()
+        gc.freeze()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Приложение готово за {time.monotonic() - started:.2f} с, '
+            f'http://{options["bind"]}/, воркеров: {options["workers"]}, '
+            f'потоков в воркере: {options["threads"]}'))
+        self.stdout.flush()
+        self.serve(server, options['workers'])
+
+    def serve(self, server, worker_count):
+        workers = {}
+        stopping = False
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                # shutdown() ждёт выхода из serve_forever, поэтому не из его потока.
+                def shutdown(signum, frame):
+                    threading.Thread(target=server.shutdown, daemon=True).start()
+
+                signal.signal(signal.SIGTERM, shutdown)
+                signal.signal(signal.SIGINT, shutdown)
+                try:
+                    server.serve_forever()
+                    server.drain(settings.SERVE_GRACEFUL_TIMEOUT)
+                finally:
+                    os._exit(0)
+            workers[pid] = time.monotonic()
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for _ in range(worker_count):
+            spawn()
+        while workers:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            spawned = workers.pop(pid, None)
+            if stopping or spawned is None:
+                continue
+            if time.monotonic() - spawned < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not stopping:
+                spawn()
+        server.server_close()
+        self.stdout.write('Сервер остановлен')
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.6 on 2026-10-19 09:47
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_group_stats(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    Post = apps.get_model('posts', 'Post')
+    for group in Group.objects.iterator():
+        posts = Post.objects.filter(group=group).order_by('-pub_date')
+        last_post = posts.first()
+        group.post_count = posts.count()
+        if last_post is not None:
+            group.last_post_date = last_post.pub_date
+            group.last_post_title = Truncator(last_post.text).chars(100)
+        group.save(update_fields=('post_count', 'last_post_date', 'last_post_title'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_trendingpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_post_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='last_post_title',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date'], name='post_group_pub_date'),
+        ),
+        migrations.RunPython(fill_group_stats, migrations.RunPython.noop),
+    ]
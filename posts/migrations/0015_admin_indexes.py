@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-19 09:58
+
+from django.db import migrations, models
+
+TEXT_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS post_text_search ON posts_post "
+    "USING GIN (to_tsvector('russian', text))"
+)
+
+
+def create_text_search_index(apps, schema_editor):
+    # Полнотекстовый индекс для поиска в админке есть только в PostgreSQL.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(TEXT_SEARCH_INDEX)
+
+
+def drop_text_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS post_text_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_digestrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created'], name='comment_created'),
+        ),
+        # Подсказка модели: индекс нужен и в шардах, где лежат записи.
+        migrations.RunPython(create_text_search_index, drop_text_search_index,
+                             hints={'model_name': 'post'}),
+    ]
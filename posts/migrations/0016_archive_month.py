@@ -0,0 +1,69 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def fill_archive_months(apps, schema_editor):
+    # Записи на шардах досчитывает команда refresh_archive.
+    ArchiveMonth = apps.get_model('posts', 'ArchiveMonth')
+    Post = apps.get_model('posts', 'Post')
+    for field in ('author_id', 'group_id'):
+        months = (Post.objects.exclude(**{field: None}).order_by()
+                  .annotate(month=TruncMonth('pub_date'))
+                  .values_list(field, 'month').annotate(Count('pk')))
+        ArchiveMonth.objects.bulk_create(
+            (ArchiveMonth(**{field: pk}, month=timezone.localtime(month).date(),
+                          post_count=count)
+             for pk, month, count in months.iterator()),
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0015_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('post_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-month',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date'], name='post_author_pub_date'),
+        ),
+        migrations.AddField(
+            model_name='archivemonth',
+            name='author',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivemonth',
+            name='group',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Group'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivemonth',
+            constraint=models.UniqueConstraint(condition=models.Q(author__isnull=False), fields=('author', 'month'), name='unique_author_month'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivemonth',
+            constraint=models.UniqueConstraint(condition=models.Q(group__isnull=False), fields=('group', 'month'), name='unique_group_month'),
+        ),
+        migrations.RunPython(fill_archive_months, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.6 on 2026-10-19 10:36
+
+from django.db import migrations, models
+
+
+def fill_search_titles(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    # lower() в Python: LOWER в SQLite не понимает кириллицу.
+    groups = list(Group.objects.only('title'))
+    for group in groups:
+        group.search_title = group.title.lower()
+    Group.objects.bulk_update(groups, ['search_title'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_stored_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='search_title',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_search_titles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-19 15:12
+
+from django.db import migrations
+
+TEXT_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS post_text_search ON posts_post "
+    "USING GIN (to_tsvector('russian', text))"
+)
+
+
+def create_text_search_index(apps, schema_editor):
+    # 0015 создавала индекс только в основной базе, без шардов.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(TEXT_SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_id_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_text_search_index, migrations.RunPython.noop,
+                             hints={'model_name': 'post'}),
+    ]
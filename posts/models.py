@@ -1,41 +1,307 @@
+from collections import Counter
+
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q, UniqueConstraint
+from django.db.models.functions import Greatest, TruncMonth
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.text import Truncator, normalize_newlines
+
+from .paginators import FEED_COUNT_TIMEOUT, follows_changed
+from .shards import ShardedManager, ShardedQuerySet, shard_aliases, sharding_enabled
+from .storage import post_image_storage
 
 User = get_user_model()
 
+LAST_POST_TITLE_LENGTH = 100
+# Длина отрывка записи в лентах, полный текст - на странице записи.
+EXCERPT_LENGTH = 500
+
+
+def last_post_title(text):
+    return Truncator(text).chars(LAST_POST_TITLE_LENGTH)
+
+
+def render_text(text):
+    """
+    Текст записи в HTML, как его выводил фильтр linebreaksbr.
+    """
+    return escape(normalize_newlines(text)).replace('\n', '<br>')
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     slug = models.SlugField(max_length=150, unique=True)
+    # Статистика для каталога сообществ, обновляется при изменении записей.
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post_date = models.DateTimeField(blank=True, null=True, editable=False)
+    last_post_title = models.CharField(max_length=LAST_POST_TITLE_LENGTH, blank=True,
+                                       editable=False)
+    # Название в нижнем регистре для поиска по префиксу (group_lookup).
+    search_title = models.CharField(max_length=200, db_index=True, default='',
+                                    editable=False)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.search_title = self.title.lower()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'title' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'search_title'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def lookup(cls, prefix, limit):
+        """
+        Сообщества, название которых начинается с prefix, без учёта регистра.
+        """
+        return (cls.objects.filter(search_title__startswith=prefix.lower())
+                .order_by('search_title').values('id', 'title')[:limit])
+
+    @classmethod
+    def refresh_stats(cls, group_ids):
+        """
+        Пересчитывает статистику сообществ по индексу (group, -pub_date).
+        """
+        group_ids = {group_id for group_id in group_ids if group_id is not None}
+        if not group_ids:
+            return
+        counts = Counter()
+        for model in (Post, ArchivedPost):
+            for alias in shard_aliases():
+                counts.update(dict(model.objects.using(alias).filter(group_id__in=group_ids)
+                                   .order_by().values_list('group_id').annotate(Count('pk'))))
+        for group_id in group_ids:
+            # Архивные записи старше горячих, к ним идём, только если горячих нет.
+            for model in (Post, ArchivedPost):
+                last_post = (model.objects.filter(group_id=group_id)
+                             .order_by('-pub_date').only('text', 'pub_date').first())
+                if last_post is not None:
+                    break
+            cls.objects.filter(pk=group_id).update(
+                post_count=counts.get(group_id, 0),
+                last_post_date=last_post and last_post.pub_date,
+                last_post_title=last_post_title(last_post.text) if last_post else '',
+            )
+
+    @classmethod
+    def register_post(cls, post):
+        """
+        Учитывает новую запись без пересчёта: один UPDATE.
+        """
+        cls.objects.filter(pk=post.group_id).update(
+            post_count=F('post_count') + 1,
+            last_post_date=post.pub_date,
+            last_post_title=last_post_title(post.text),
+        )
+
+
+INACTIVE_AUTHORS_KEY = 'inactive_author_ids'
+
+
+def inactive_author_ids():
+    return cache.get_or_set(
+        INACTIVE_AUTHORS_KEY,
+        lambda: list(User.objects.filter(is_active=False).values_list('pk', flat=True)),
+        FEED_COUNT_TIMEOUT)
+
+
+class PostQuerySet(ShardedQuerySet):
+    shard_field = 'author'
+
+    def for_list(self):
+        # В лентах показывается отрывок, полный текст не читается.
+        return self.defer('text', 'text_html').by_active_authors()
+
+    def by_active_authors(self):
+        # Записи отключённого пользователя скрыты, пока их удаляет delete_user.
+        if sharding_enabled():
+            # Пользователи лежат в основной базе, join с ними на шардах невозможен.
+            return self.exclude(author_id__in=inactive_author_ids())
+        return self.filter(author__is_active=True)
+
+    def followed_by(self, user):
+        if sharding_enabled():
+            # Подписки лежат в основной базе, join с ними на шардах невозможен.
+            author_ids = list(user.follower.values_list('author_id', flat=True))
+            return self.filter(author_id__in=author_ids)
+        return self.filter(author__following__user=user)
+
+
+class IdSequence(models.Model):
+    """
+    Счётчик id, общий для шардов: автоинкремент каждого шарда выдал бы
+    записям разных авторов одинаковые id. Лежит в основной базе.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, id_models):
+        """
+        Следующий id для первой из id_models. Первый вызов продолжает
+        id, уже занятые в шардах любой из id_models.
+        """
+        name = id_models[0]._meta.label_lower
+        sequence = cls.objects.using('default')
+        with transaction.atomic(using='default'):
+            if not sequence.filter(name=name).update(value=F('value') + 1):
+                start = max(model._base_manager.using(alias).aggregate(last=Max('pk'))['last'] or 0
+                            for model in id_models for alias in shard_aliases())
+                sequence.bulk_create([cls(name=name, value=start)], ignore_conflicts=True)
+                sequence.filter(name=name).update(value=F('value') + 1)
+            return sequence.get(name=name).value
+
+
+class ShardedId:
+    """
+    При нескольких шардах id новому объекту выдаёт IdSequence.
+    """
+    # Архивная модель, в которую объекты переносятся с прежним id.
+    archive_model = None
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and sharding_enabled():
+            id_models = [type(self)]
+            if self.archive_model:
+                id_models.append(self._meta.apps.get_model(self.archive_model))
+            self.pk = IdSequence.allocate(id_models)
+        super().save(*args, **kwargs)
+
+
+class RenderedText:
+    """
+    HTML текста и отрывка готовится при сохранении записи, а не при
+    каждом показе.
+    """
+
+    def render(self):
+        self.text_html = render_text(self.text)
+        self.excerpt = render_text(Truncator(self.text).chars(EXCERPT_LENGTH))
 
-class Post(models.Model):
+    def save(self, *args, **kwargs):
+        if 'text' not in self.get_deferred_fields():
+            self.render()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'text' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'text_html', 'excerpt'}
+        super().save(*args, **kwargs)
+
+
+class Post(ShardedId, RenderedText, models.Model):
     text = models.TextField(verbose_name='Новая запись')
+    text_html = models.TextField(default='', editable=False)
+    excerpt = models.TextField(default='', editable=False)
     pub_date = models.DateTimeField('date published', auto_now_add=True, db_index=True)
+    # Автор и сообщество могут лежать в другой базе, чем шард записи,
+    # поэтому ограничения внешнего ключа в базе не создаются.
     author = models.ForeignKey(User, on_delete=models.CASCADE,
-                               related_name='posts')
-    group = models.ForeignKey(Group, on_delete=models.SET_NULL,
+                               related_name='posts', db_constraint=False)
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL, db_constraint=False,
                               related_name='posts', blank=True, null=True, verbose_name='Группа')
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=post_image_storage,
+                              blank=True, null=True)
+
+    objects = PostQuerySet.as_manager()
+
+    archive_model = 'posts.ArchivedPost'
+    is_archived = False
 
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=('group', '-pub_date'), name='post_group_pub_date'),
+            models.Index(fields=('author', '-pub_date'), name='post_author_pub_date'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сообщество на момент загрузки: по нему сигналы понимают,
+        # что запись перенесли в другое сообщество.
+        instance._loaded_group_id = instance.__dict__.get('group_id')
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
 
+class CommentQuerySet(ShardedQuerySet):
+    shard_field = 'post'
 
-class Comment(models.Model):
+
+class CommentManager(ShardedManager):
+    queryset_class = CommentQuerySet
+
+
+class Comment(ShardedId, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
-    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments',
+                               db_constraint=False)
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = CommentManager()
+
+    archive_model = 'posts.ArchivedComment'
+
+    def __str__(self):
+        return self.text
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=('created',), name='comment_created'),
+        ]
+
+
+class ArchivedPost(RenderedText, models.Model):
+    """
+    Старая запись, перенесённая из Post командой archive_posts. Хранится
+    с прежним id, чтобы ссылки на запись продолжали работать.
+    """
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField()
+    text_html = models.TextField(default='', editable=False)
+    excerpt = models.TextField(default='', editable=False)
+    pub_date = models.DateTimeField(db_index=True)
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='archived_posts', db_constraint=False)
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL, db_constraint=False,
+                              related_name='archived_posts', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=post_image_storage,
+                              blank=True, null=True)
+
+    objects = PostQuerySet.as_manager()
+
+    is_archived = True
+
+    def __str__(self):
+        return self.text
+
+    class Meta:
+        ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=('group', '-pub_date'), name='archivedpost_group_pub_date'),
+            models.Index(fields=('author', '-pub_date'), name='archivedpost_author_pub_date'),
+        ]
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+',
+                               db_constraint=False)
+    text = models.TextField()
+    created = models.DateTimeField()
+
+    objects = CommentManager()
+
     def __str__(self):
         return self.text
 
@@ -43,14 +309,230 @@ class Comment(models.Model):
         ordering = ('-created',)
 
 
+def month_start(moment):
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+class ArchiveMonth(models.Model):
+    """
+    Число записей автора или сообщества за месяц для архива. Новые и
+    удалённые записи учитываются сигналами, массовые операции
+    пересчитывают затронутых авторов и сообщества методом refresh.
+    """
+    author = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, related_name='+')
+    month = models.DateField()
+    post_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ('-month',)
+        constraints = [
+            UniqueConstraint(fields=('author', 'month'), condition=Q(author__isnull=False),
+                             name='unique_author_month'),
+            UniqueConstraint(fields=('group', 'month'), condition=Q(group__isnull=False),
+                             name='unique_group_month'),
+        ]
+
+    def __str__(self):
+        return f'{self.month:%m.%Y}: {self.post_count}'
+
+    @classmethod
+    def add(cls, month, amount, author_id=None, group_id=None):
+        lookup = {'author_id': author_id, 'group_id': group_id, 'month': month}
+        updated = cls.objects.filter(**lookup).update(post_count=F('post_count') + amount)
+        if not updated:
+            cls.objects.bulk_create([cls(**lookup)], ignore_conflicts=True)
+            cls.objects.filter(**lookup).update(post_count=F('post_count') + amount)
+
+    @classmethod
+    def refresh(cls, author_ids=(), group_ids=()):
+        """
+        Пересчитывает месяцы авторов и сообществ по индексам
+        (author, -pub_date) и (group, -pub_date).
+        """
+        for field, ids in (('author_id', author_ids), ('group_id', group_ids)):
+            for pk in set(ids) - {None}:
+                counts = Counter()
+                for model in (Post, ArchivedPost):
+                    months = (model.objects.filter(**{field: pk}).order_by()
+                              .annotate(month=TruncMonth('pub_date'))
+                              .values_list('month').annotate(Count('pk')))
+                    for month, count in months:
+                        counts[month_start(month)] += count
+                with transaction.atomic():
+                    cls.objects.filter(**{field: pk}).delete()
+                    cls.objects.bulk_create(
+                        cls(**{field: pk}, month=month, post_count=count)
+                        for month, count in counts.items()
+                    )
+
+    @classmethod
+    def for_author(cls, author):
+        return cls.objects.filter(author=author, post_count__gt=0).only('month', 'post_count')
+
+    @classmethod
+    def for_group(cls, group):
+        return cls.objects.filter(group=group, post_count__gt=0).only('month', 'post_count')
+
+
+class TrendingPostQuerySet(ShardedQuerySet):
+    shard_field = 'post'
+
+
+class TrendingPost(models.Model):
+    """
+    Счёт популярности записи: растёт с каждым комментарием
+    и периодически затухает командой decay_trending.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True,
+                                related_name='trending')
+    score = models.FloatField(default=0, db_index=True)
+
+    objects = TrendingPostQuerySet.as_manager()
+
+    @classmethod
+    def bump(cls, post_id, amount=1, using=None):
+        trending = cls.objects.db_manager(using)
+        updated = trending.filter(post_id=post_id).update(score=F('score') + amount)
+        if not updated:
+            trending.bulk_create([cls(post_id=post_id, score=0)], ignore_conflicts=True)
+            trending.filter(post_id=post_id).update(score=F('score') + amount)
+
+
+class FollowQuerySet(models.QuerySet):
+    def follow(self, user, author):
+        """
+        Подписка одним INSERT: повторная подписка молча игнорируется
+        на уровне базы, поэтому двойной клик не упирается в unique_list.
+        """
+        if user == author:
+            return
+        self.bulk_create([self.model(user=user, author=author)],
+                         ignore_conflicts=True)
+        follows_changed(user.pk)
+
+    def unfollow(self, user, author):
+        """
+        Отписка одним DELETE, возвращает число удалённых строк.
+        """
+        deleted, _ = self.filter(user=user, author=author).delete()
+        follows_changed(user.pk)
+        return deleted
+
+    def bulk_follow(self, user, usernames, batch_size=500):
+        """
+        Подписывает user на всех авторов из usernames в одной транзакции:
+        авторы выбираются и вставляются пачками по batch_size.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(usernames), batch_size):
+                batch = usernames[start:start + batch_size]
+                author_ids = (User.objects.filter(username__in=batch)
+                              .exclude(pk=user.pk)
+                              .values_list('pk', flat=True))
+                self.bulk_create(
+                    [self.model(user=user, author_id=pk) for pk in author_ids],
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
+                )
+        follows_changed(user.pk)
+
+    def export(self, user):
+        """
+        Имена авторов, на которых подписан user, в алфавитном порядке.
+        """
+        return (self.filter(user=user)
+                .order_by('author__username')
+                .values_list('author__username', flat=True))
+
+
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
 
+    objects = FollowQuerySet.as_manager()
+
     def __str__(self):
-        return self.text
+        return f'{self.user} → {self.author}'
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=('user', 'author'), name='unique_list'),
         ]
+
+
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ('-score',)
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'author'), name='unique_recommendation'),
+        ]
+        indexes = [
+            models.Index(fields=('user', '-score'), name='recommendation_user_score'),
+        ]
+
+
+class RecommendationState(models.Model):
+    """
+    Отпечаток подписок пользователя на момент последнего расчёта
+    рекомендаций, по нему пересчитываются только изменившиеся.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='+')
+    digest = models.CharField(max_length=32)
+
+
+class DigestRun(models.Model):
+    """
+    Рассылка дайджеста новых записей за [since, until). cursor - id
+    последнего обработанного подписчика: прерванная рассылка
+    продолжается с него.
+    """
+    since = models.DateTimeField()
+    until = models.DateTimeField()
+    cursor = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('-until',)
+
+    def __str__(self):
+        return f'{self.since:%Y-%m-%d %H:%M} - {self.until:%Y-%m-%d %H:%M}'
+
+
+class StoredImage(models.Model):
+    """
+    Файл изображения в хранилище по хэшу (posts.storage) и число записей,
+    которые на него ссылаются. Файлы без ссылок удаляет prune_images.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def retain(cls, name):
+        """
+        Учитывает ещё одну ссылку на файл. True - если это первая ссылка
+        и миниатюры для файла ещё не делались.
+        """
+        if cls.objects.filter(name=name).update(refcount=F('refcount') + 1,
+                                                updated=timezone.now()):
+            return False
+        cls.objects.bulk_create([cls(name=name)], ignore_conflicts=True)
+        cls.objects.filter(name=name).update(refcount=F('refcount') + 1, updated=timezone.now())
+        return True
+
+    @classmethod
+    def release(cls, names):
+        for name, count in Counter(names).items():
+            cls.objects.filter(name=name).update(
+                refcount=Greatest(F('refcount') - count, 0), updated=timezone.now())
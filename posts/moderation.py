@@ -0,0 +1,214 @@
+"""
+Массовые операции модерации.
+
+Записи обрабатываются пачками по возрастанию pk (без OFFSET), каждая пачка -
+отдельный UPDATE/DELETE в своей короткой транзакции, так что строки
+не блокируются надолго. Сигналы записей не срабатывают: при удалении
+картинки освобождаются и размеры лент сбрасываются по каждой пачке, а
+статистика затронутых сообществ и архив пересчитываются в конце.
+"""
+from django.core.cache import cache
+from django.db import connections, transaction
+
+from jobs.queue import enqueue
+from users.backends import forget_user
+
+from . import tasks
+from .models import (INACTIVE_AUTHORS_KEY, ArchivedComment, ArchivedPost, Comment, Follow, Group,
+                     Post, Recommendation, RecommendationState, StoredImage, TrendingPost, User)
+from .paginators import archive_changed, feeds_changed, follows_changed
+from .shards import shard_aliases
+from .storage import is_content_addressed
+
+MODERATION_CHUNK_SIZE = 1000
+
+
+def chunked_pks(queryset, chunk_size=MODERATION_CHUNK_SIZE):
+    """
+    Первичные ключи выборки одной базы пачками по возрастанию.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(chunk[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def post_chunks(queryset, chunk_size=MODERATION_CHUNK_SIZE):
+    """
+    Пары (база, pk записей) по всем шардам, если выборка не привязана к базе.
+    """
+    aliases = [queryset.db] if queryset._db else shard_aliases()
+    for alias in aliases:
+        for pks in chunked_pks(queryset.using(alias), chunk_size):
+            yield alias, pks
+
+
+def delete_rows(alias, model, pks):
+    """
+    Удаляет строки model по первичным ключам одним DELETE, без загрузки
+    объектов и без сигналов: связанные строки, картинки и ленты вызывающий
+    обрабатывает сам в той же транзакции.
+    """
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {quote(model._meta.pk.column)} IN ({placeholders})',
+            pks,
+        )
+        return cursor.rowcount
+
+
+def _related_ids(model, alias, pks, field):
+    return set(model.objects.using(alias).filter(pk__in=pks).exclude(**{field: None})
+               .order_by().values_list(field, flat=True).distinct())
+
+
+def _image_names(model, alias, pks):
+    names = (model.objects.using(alias).filter(pk__in=pks).exclude(image='')
+             .values_list('image', flat=True))
+    return [name for name in names if is_content_addressed(name)]
+
+
+def _refresh_stats(model, group_ids, author_ids=()):
+    if model is ArchivedPost:
+        archive_changed()
+    if group_ids:
+        enqueue(tasks.refresh_group_stats, group_ids=sorted(group_ids))
+    if group_ids or author_ids:
+        enqueue(tasks.refresh_archive, author_ids=sorted(author_ids),
+                group_ids=sorted(group_ids))
+
+
+def move_posts(queryset, group, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Переносит записи выборки (Post или ArchivedPost) в сообщество group
+    (None - убрать из сообщества).
+    """
+    model = queryset.model
+    group_id = group and group.pk
+    affected = {group_id} - {None}
+    moved = 0
+    for alias, pks in post_chunks(queryset, chunk_size):
+        with transaction.atomic(using=alias):
+            affected |= _related_ids(model, alias, pks, 'group_id')
+            moved += model.objects.using(alias).filter(pk__in=pks).update(group_id=group_id)
+        if progress:
+            progress(moved)
+    feeds_changed(group_ids=affected)
+    _refresh_stats(model, affected)
+    return moved
+
+
+def merge_groups(sources, target, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Переносит записи сообществ sources, включая архивные, в target
+    и удаляет sources.
+    """
+    source_ids = [group.pk for group in sources if group.pk != target.pk]
+    moved = sum(move_posts(model.objects.filter(group_id__in=source_ids), target,
+                           chunk_size, progress)
+                for model in (Post, ArchivedPost))
+    Group.objects.filter(pk__in=source_ids).delete()
+    return moved
+
+
+def delete_posts(queryset, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Удаляет записи выборки (Post или ArchivedPost) вместе с комментариями
+    и счётом популярности прямыми DELETE, без загрузки объектов в память.
+    """
+    model = queryset.model
+    comment_model = ArchivedComment if model is ArchivedPost else Comment
+    affected, authors = set(), set()
+    deleted = 0
+    for alias, pks in post_chunks(queryset, chunk_size):
+        with transaction.atomic(using=alias):
+            chunk_groups = _related_ids(model, alias, pks, 'group_id')
+            chunk_authors = _related_ids(model, alias, pks, 'author_id')
+            images = _image_names(model, alias, pks)
+            comment_model.objects.using(alias).filter(post_id__in=pks).delete()
+            if model is Post:
+                TrendingPost.objects.using(alias).filter(post_id__in=pks).delete()
+            deleted += delete_rows(alias, model, pks)
+        StoredImage.release(images)
+        feeds_changed(chunk_authors, chunk_groups)
+        affected |= chunk_groups
+        authors |= chunk_authors
+        if progress:
+            progress(deleted)
+    _refresh_stats(model, affected, authors)
+    return deleted
+
+
+def _delete_chunked(queryset, chunk_size):
+    """
+    Удаляет выборку одной базы пачками, каждую своим DELETE.
+    """
+    alias = queryset.db
+    deleted = 0
+    for pks in chunked_pks(queryset, chunk_size):
+        deleted += queryset.model.objects.using(alias).filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def _follower_ids(user_id):
+    return list(Follow.objects.filter(author_id=user_id).values_list('user_id', flat=True))
+
+
+def deactivate_user(user):
+    """
+    Скрывает пользователя сразу: профиль и записи отдают 404, войти нельзя,
+    из лент записи пропадают (главная - когда истечёт её кэш страницы).
+    Сами данные удаляет фоновая задача delete_user.
+    """
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    forget_user(user.pk)
+    cache.delete(INACTIVE_AUTHORS_KEY)
+    group_ids = set()
+    for model in (Post, ArchivedPost):
+        group_ids.update(model.objects.filter(author_id=user.pk, group__isnull=False)
+                         .order_by().values_list('group_id', flat=True).distinct())
+    feeds_changed([user.pk], group_ids)
+    follows_changed(*_follower_ids(user.pk))
+    enqueue(tasks.delete_user, user_id=user.pk)
+
+
+def delete_user_content(user_id, chunk_size=MODERATION_CHUNK_SIZE, progress=None):
+    """
+    Удаляет записи, комментарии, подписки и рекомендации пользователя
+    пачками, а затем самого пользователя. Повторный запуск после сбоя
+    продолжает с того, что осталось.
+    """
+    def report(stage, done):
+        if progress:
+            progress(stage, done)
+
+    report('posts', delete_posts(Post.objects.filter(author_id=user_id), chunk_size,
+                                 progress=lambda done: report('posts', done)))
+    report('archived posts', delete_posts(ArchivedPost.objects.filter(author_id=user_id),
+                                          chunk_size))
+    # Комментарии к чужим записям лежат в шардах их авторов.
+    comments = sum(_delete_chunked(model.objects.using(alias).filter(author_id=user_id),
+                                   chunk_size)
+                   for model in (Comment, ArchivedComment)
+                   for alias in shard_aliases())
+    report('comments', comments)
+    follower_ids = _follower_ids(user_id)
+    for stage, model in (('follows', Follow), ('recommendations', Recommendation)):
+        deleted = (_delete_chunked(model.objects.filter(user_id=user_id), chunk_size)
+                   + _delete_chunked(model.objects.filter(author_id=user_id), chunk_size))
+        report(stage, deleted)
+    # Ленты подписок бывших подписчиков стали короче.
+    follows_changed(*follower_ids)
+    RecommendationState.objects.filter(user_id=user_id).delete()
+    # Связанных строк не осталось, обычное удаление проходит быстро.
+    User.objects.filter(pk=user_id).delete()
+    report('user', 1)
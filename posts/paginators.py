@@ -0,0 +1,117 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .shards import shard_querysets
+
+# Ниже этого порога оценке планировщика не доверяем и считаем точно.
+EXACT_COUNT_THRESHOLD = 10000
+COUNT_CACHE_TIMEOUT = 60
+# Размеры лент сбрасываются при записи (feeds_changed), срок - на случай
+# изменений в обход ORM.
+FEED_COUNT_TIMEOUT = 60 * 60
+ARCHIVE_GENERATION_KEY = 'archive_generation'
+
+
+def feed_generation_key(scope):
+    return f'feed_generation:{scope}'
+
+
+def feed_generations(scopes):
+    keys = [feed_generation_key(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    return ':'.join(str(generations.get(key, 0)) for key in keys)
+
+
+def bump_feed_generations(scopes):
+    for scope in scopes:
+        key = feed_generation_key(scope)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def feeds_changed(author_ids=(), group_ids=()):
+    """
+    Сбрасывает закэшированные размеры общей ленты и лент авторов и
+    сообществ после добавления, удаления или переноса записей.
+    """
+    bump_feed_generations(['all', *(f'author:{author_id}' for author_id in author_ids),
+                           *(f'group:{group_id}' for group_id in group_ids)])
+
+
+def follows_changed(*user_ids):
+    bump_feed_generations([f'follower:{user_id}' for user_id in user_ids])
+
+
+def archive_generation():
+    return cache.get_or_set(ARCHIVE_GENERATION_KEY, 0, None)
+
+
+def archive_changed():
+    """
+    Сбрасывает закэшированные размеры архива и лент после изменения архивных записей.
+    """
+    cache.set(ARCHIVE_GENERATION_KEY, archive_generation() + 1, None)
+
+
+def cached_count(queryset, prefix, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    COUNT(*) выборки из кэша. prefix должен меняться вместе с данными.
+    """
+    try:
+        sql = str(queryset.query)
+    except EmptyResultSet:
+        return 0
+    key = f'{prefix}:{hashlib.md5(sql.encode()).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа строк по статистике PostgreSQL (EXPLAIN), без COUNT(*),
+    сложенная по всем шардам выборки. Для других баз возвращает None.
+    """
+    estimates = [planner_rows(part) for part in shard_querysets(queryset)]
+    if None in estimates:
+        return None
+    return sum(estimates)
+
+
+def planner_rows(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для админки: на больших таблицах берёт оценку числа строк
+    из статистики базы, точный COUNT(*) кэширует на минуту.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = estimated_count(queryset)
+        if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+            return estimate
+        return cached_count(queryset, 'admin_count')
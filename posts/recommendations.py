@@ -0,0 +1,117 @@
+import hashlib
+from array import array
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from .models import Follow, Recommendation, RecommendationState
+
+CO_FOLLOW_WEIGHT = 0.5
+# Сколько подписчиков автора учитывать при поиске похожих читателей,
+# чтобы популярные авторы не раздували расчёт.
+MAX_CO_FOLLOWERS = 200
+
+
+class FollowGraph:
+    """
+    Граф подписок в виде отсортированных массивов id: кто на кого подписан
+    и кто на кого подписан в обратную сторону.
+    """
+
+    def __init__(self, edges):
+        following = defaultdict(lambda: array('l'))
+        followers = defaultdict(lambda: array('l'))
+        for user_id, author_id in edges:
+            following[user_id].append(author_id)
+            followers[author_id].append(user_id)
+        self.following = dict(following)
+        self.followers = dict(followers)
+
+    @classmethod
+    def load(cls, chunk_size=10000):
+        edges = (Follow.objects.order_by('user_id', 'author_id')
+                 .values_list('user_id', 'author_id')
+                 .iterator(chunk_size=chunk_size))
+        return cls(edges)
+
+    def digest(self, user_id):
+        return hashlib.md5(self.following[user_id].tobytes()).hexdigest()
+
+    def candidates(self, user_id, limit):
+        following = self.following.get(user_id, ())
+        scores = Counter()
+        # Друзья друзей: авторы, на которых подписаны мои авторы.
+        for author_id in following:
+            scores.update(self.following.get(author_id, ()))
+        # Совместные подписки: что ещё читают подписчики моих авторов.
+        co_follow = Counter()
+        for author_id in following:
+            for reader_id in self.followers[author_id][:MAX_CO_FOLLOWERS]:
+                if reader_id != user_id:
+                    co_follow.update(self.following[reader_id])
+        for author_id, count in co_follow.items():
+            scores[author_id] += CO_FOLLOW_WEIGHT * count
+        scores.pop(user_id, None)
+        for author_id in following:
+            scores.pop(author_id, None)
+        return scores.most_common(limit)
+
+    def affected_by(self, user_ids):
+        """
+        Пользователи, чьи рекомендации зависят от подписок user_ids:
+        они сами, их подписчики и читатели общих авторов, у которых
+        user_ids попадают в совместные подписки (не больше MAX_CO_FOLLOWERS
+        на автора). Отписки от общих авторов и читателей сверх лимита
+        учитывает только полный пересчёт.
+        """
+        affected = set(user_ids)
+        for user_id in user_ids:
+            affected.update(self.followers.get(user_id, ()))
+            for author_id in self.following.get(user_id, ()):
+                readers = self.followers[author_id][:MAX_CO_FOLLOWERS]
+                if user_id in readers:
+                    affected.update(readers)
+        return affected
+
+
+def refresh_recommendations(limit=10, full=False, batch_size=500):
+    """
+    Пересчитывает рекомендации и возвращает число обновлённых пользователей.
+    Без full пересчитываются только пользователи с изменившимися
+    подписками и зависящие от них (см. FollowGraph.affected_by), поэтому
+    пересчёт приблизительный: full нужно запускать по расписанию.
+    """
+    graph = FollowGraph.load()
+    stored = dict(RecommendationState.objects.values_list('user_id', 'digest'))
+    digests = {user_id: graph.digest(user_id) for user_id in graph.following}
+    removed = stored.keys() - digests.keys()
+    if full:
+        changed = set(digests)
+    else:
+        changed = {user_id for user_id, digest in digests.items()
+                   if stored.get(user_id) != digest}
+    affected = sorted(graph.affected_by(changed | removed) - removed)
+
+    if removed:
+        removed = list(removed)
+        with transaction.atomic():
+            Recommendation.objects.filter(user_id__in=removed).delete()
+            RecommendationState.objects.filter(user_id__in=removed).delete()
+
+    for start in range(0, len(affected), batch_size):
+        batch = affected[start:start + batch_size]
+        recommendations = [
+            Recommendation(user_id=user_id, author_id=author_id, score=score)
+            for user_id in batch
+            for author_id, score in graph.candidates(user_id, limit)
+        ]
+        with transaction.atomic():
+            Recommendation.objects.filter(user_id__in=batch).delete()
+            Recommendation.objects.bulk_create(recommendations, batch_size=batch_size)
+            RecommendationState.objects.filter(user_id__in=batch).delete()
+            RecommendationState.objects.bulk_create(
+                [RecommendationState(user_id=user_id, digest=digests[user_id])
+                 for user_id in batch],
+                batch_size=batch_size,
+            )
+    return len(affected)
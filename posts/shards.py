@@ -0,0 +1,234 @@
+"""
+Шардирование записей по автору.
+
+Записи автора живут в базе settings.POST_SHARDS[author_id % len(POST_SHARDS)],
+комментарии и счёт популярности - рядом со своей записью. Пользователи,
+сообщества и подписки остаются в основной базе. id записей и комментариев
+общие для всех шардов (models.IdSequence).
+"""
+import heapq
+from functools import cmp_to_key
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query import ModelIterable
+
+
+# Как собрать агрегаты шардов в один. Среднее и DISTINCT так не собрать.
+SHARD_AGGREGATES = {models.Count: sum, models.Sum: sum, models.Max: max, models.Min: min}
+
+
+def shard_aliases():
+    return settings.POST_SHARDS
+
+
+def sharding_enabled():
+    return len(settings.POST_SHARDS) > 1
+
+
+def is_sharded(model_or_instance):
+    return model_or_instance._meta.label_lower in settings.SHARDED_MODELS
+
+
+def shard_for_author(author_id):
+    shards = settings.POST_SHARDS
+    return shards[author_id % len(shards)]
+
+
+def shard_for_instance(instance):
+    """
+    База, в которой лежат (или должны лежать) записи, связанные с instance.
+    """
+    label = instance._meta.label_lower
+    if label == settings.AUTH_USER_MODEL.lower():
+        return shard_for_author(instance.pk)
+    if label in ('posts.post', 'posts.archivedpost'):
+        # У новой записи _state.db мог выставить присвоенный ей объект из
+        # основной базы (например, сообщество): шард определяет автор.
+        if instance._state.db and not instance._state.adding:
+            return instance._state.db
+        return shard_for_author(instance.author_id)
+    if is_sharded(instance):
+        if instance._state.db:
+            return instance._state.db
+        post_field = instance._meta.get_field('post')
+        if post_field.is_cached(instance):
+            return shard_for_instance(post_field.get_cached_value(instance))
+    return None
+
+
+def shard_querysets(queryset):
+    """
+    Выборка по отдельности для каждого шарда, который она читает.
+    """
+    if isinstance(queryset, ShardedQuerySet) and queryset._scattered():
+        return [queryset.using(alias) for alias in shard_aliases()]
+    return [queryset]
+
+
+def merge_key(ordering):
+    """
+    Ключ для слияния отсортированных выборок шардов по полям ordering.
+    """
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def compare(left, right):
+        for name, descending in fields:
+            a, b = getattr(left, name), getattr(right, name)
+            if a == b:
+                continue
+            if a is None or b is None:
+                result = -1 if a is None else 1
+            else:
+                result = -1 if a < b else 1
+            return -result if descending else result
+        return 0
+
+    return cmp_to_key(compare)
+
+
+def create_in_shard(model, kwargs):
+    obj = model(**kwargs)
+    obj.save(force_insert=True, using=shard_for_instance(obj))
+    return obj
+
+
+class ShardedManager(models.Manager):
+    """
+    Менеджер моделей, которые лежат рядом со своей записью. При нескольких
+    шардах выборки идут через queryset_class (ShardedQuerySet) и читают все
+    шарды, с одной базой остаются обычным QuerySet.
+    """
+    queryset_class = None
+
+    def get_queryset(self):
+        if not sharding_enabled():
+            return super().get_queryset()
+        return self.queryset_class(model=self.model, using=self._db, hints=self._hints)
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    Запрос с фильтром по ключу шарда уходит в один шард. Остальные
+    запросы выполняются на всех шардах, а отсортированные результаты
+    сливаются k-way merge, так что срезы пагинатора остаются верными.
+    Сортировки, которые так не слить, и агрегаты, которые не сложить,
+    выборка отвергает с NotImplementedError.
+    """
+    shard_field = None
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        clone = super()._filter_or_exclude(negate, *args, **kwargs)
+        if not negate and clone._db is None and sharding_enabled():
+            alias = self._shard_from_lookups(kwargs)
+            if alias is not None:
+                clone = clone.using(alias)
+        return clone
+
+    def _shard_from_lookups(self, lookups):
+        field = self.shard_field
+        for lookup in (field, f'{field}__exact', f'{field}_id', f'{field}__id', f'{field}__pk'):
+            if lookup not in lookups:
+                continue
+            value = lookups[lookup]
+            if isinstance(value, models.Model):
+                return shard_for_instance(value)
+            if isinstance(value, int) and field == 'author':
+                return shard_for_author(value)
+        return None
+
+    def _scattered(self):
+        return self._db is None and sharding_enabled()
+
+    def _merge_key(self):
+        ordering = self.query.order_by or (
+            self.query.default_ordering and self.model._meta.ordering)
+        if not ordering or list(ordering) == ['?']:
+            # Порядок не важен: части шардов просто идут подряд.
+            return None
+        if self._iterable_class is not ModelIterable or not all(
+                isinstance(name, str) and '__' not in name and name != '?'
+                for name in ordering):
+            # Иначе строки молча пришли бы не в том порядке.
+            raise NotImplementedError(
+                f'Слияние шардов по {list(ordering)} не поддерживается: сортировать '
+                'можно только объекты модели и только по её собственным полям')
+        return merge_key(ordering)
+
+    def _gather(self, chunk_size=None):
+        key = self._merge_key()
+        low, high = self.query.low_mark, self.query.high_mark
+        parts = []
+        for alias in shard_aliases():
+            clone = self.using(alias)
+            clone.query.clear_limits()
+            clone.query.set_limits(0, high)
+            parts.append(clone.iterator(chunk_size) if chunk_size else iter(clone))
+        merged = heapq.merge(*parts, key=key) if key else chain(*parts)
+        return islice(merged, low, high)
+
+    def create(self, **kwargs):
+        if not self._scattered():
+            return super().create(**kwargs)
+        return create_in_shard(self.model, kwargs)
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._scattered():
+            self._result_cache = list(self._gather())
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=2000):
+        if self._scattered():
+            return self._gather(chunk_size)
+        return super().iterator(chunk_size)
+
+    def count(self):
+        if self._result_cache is None and self._scattered():
+            if not self.query.can_filter():
+                return len(self)
+            return sum(self.using(alias).count() for alias in shard_aliases())
+        return super().count()
+
+    def aggregate(self, *args, **kwargs):
+        if not self._scattered():
+            return super().aggregate(*args, **kwargs)
+        expressions = {**{arg.default_alias: arg for arg in args}, **kwargs}
+        combine = {}
+        for name, expression in expressions.items():
+            combine[name] = SHARD_AGGREGATES.get(type(expression))
+            if combine[name] is None or getattr(expression, 'distinct', False):
+                raise NotImplementedError(
+                    f'{expression!r} нельзя сложить по шардам: считайте по каждому шарду')
+        parts = [self.using(alias).aggregate(**expressions) for alias in shard_aliases()]
+        result = {}
+        for name, function in combine.items():
+            values = [part[name] for part in parts if part[name] is not None]
+            result[name] = function(values) if values else None
+        return result
+
+    def exists(self):
+        if self._result_cache is None and self._scattered():
+            return any(self.using(alias).exists() for alias in shard_aliases())
+        return super().exists()
+
+    def update(self, **kwargs):
+        if self._scattered():
+            return sum(self.using(alias).update(**kwargs) for alias in shard_aliases())
+        return super().update(**kwargs)
+
+    update.alters_data = True
+
+    def delete(self):
+        if not self._scattered():
+            return super().delete()
+        deleted, per_model = 0, {}
+        for alias in shard_aliases():
+            count, counts = self.using(alias).delete()
+            deleted += count
+            for label, value in counts.items():
+                per_model[label] = per_model.get(label, 0) + value
+        return deleted, per_model
+
+    delete.alters_data = True
+    delete.queryset_only = True
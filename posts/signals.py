@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from jobs.queue import enqueue
+
+from . import tasks
+from .events import bus, post_channels
+from .models import Comment, Group, Post, StoredImage, month_start
+from .paginators import feeds_changed
+from .storage import is_content_addressed
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    using = instance._state.db
+    month = month_start(instance.pub_date).isoformat()
+    if created:
+        feeds_changed([instance.author_id], [instance.group_id] if instance.group_id else [])
+        channels = post_channels(instance)
+        transaction.on_commit(lambda: bus.publish(channels), using=using)
+        if instance.group_id:
+            enqueue(tasks.register_group_post, post_id=instance.pk, using=using)
+        enqueue(tasks.count_archive_post, month=month, amount=1, using=using,
+                author_id=instance.author_id, group_id=instance.group_id)
+    else:
+        loaded_group_id = getattr(instance, '_loaded_group_id', None)
+        if loaded_group_id != instance.group_id:
+            group_ids = {loaded_group_id, instance.group_id} - {None}
+            enqueue(tasks.refresh_group_stats, group_ids=sorted(group_ids), using=using)
+            feeds_changed(group_ids=group_ids)
+            if loaded_group_id:
+                enqueue(tasks.count_archive_post, month=month, amount=-1, using=using,
+                        group_id=loaded_group_id)
+            if instance.group_id:
+                enqueue(tasks.count_archive_post, month=month, amount=1, using=using,
+                        group_id=instance.group_id)
+        elif is_latest_group_post(instance):
+            # Правка последней записи меняет её заголовок в каталоге сообществ.
+            enqueue(tasks.refresh_group_stats, group_ids=[instance.group_id], using=using)
+    if 'image' not in instance.get_deferred_fields():
+        if image_changed(getattr(instance, '_loaded_image', None), instance.image.name):
+            enqueue(tasks.make_thumbnail, post_id=instance.pk, using=using)
+        instance._loaded_image = instance.image.name
+    instance._loaded_group_id = instance.group_id
+
+
+def is_latest_group_post(post):
+    """
+    Запись новее или ровесница последней записи своего сообщества.
+    """
+    return bool(post.group_id) and Group.objects.filter(
+        pk=post.group_id, last_post_date__lte=post.pub_date).exists()
+
+
+def image_changed(old_name, new_name):
+    """
+    Переносит ссылку со старого файла на новый. True, если для нового
+    файла нужны миниатюры: у одинаковых картинок они общие.
+    """
+    if (old_name or '') == (new_name or ''):
+        return False
+    if is_content_addressed(old_name):
+        StoredImage.release([old_name])
+    if is_content_addressed(new_name):
+        return StoredImage.retain(new_name)
+    return bool(new_name)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    using = instance._state.db
+    if 'image' not in instance.get_deferred_fields():
+        image_changed(instance.image.name, None)
+    feeds_changed([instance.author_id], [instance.group_id] if instance.group_id else [])
+    if instance.group_id:
+        enqueue(tasks.refresh_group_stats, group_ids=[instance.group_id], using=using)
+    enqueue(tasks.count_archive_post, month=month_start(instance.pub_date).isoformat(),
+            amount=-1, author_id=instance.author_id, group_id=instance.group_id,
+            using=using)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        enqueue(tasks.bump_trending, post_id=instance.post_id, using=instance._state.db)
@@ -0,0 +1,92 @@
+"""
+Хранилище изображений записей по хэшу содержимого.
+
+Загруженный файл пишется во временный файл с одновременным подсчётом
+sha256 и затем переименовывается в posts/ab/cd/<sha256>.<ext>. Если файл
+с таким содержимым уже есть, новая копия просто удаляется, поэтому
+одинаковые картинки хранятся (и уменьшаются sorl-thumbnail) один раз.
+Временный файл загрузки с готовым хэшем (posts.uploads) переносится
+на место без повторного чтения. Сколько записей ссылается на файл,
+считает модель StoredImage.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+DIGEST_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def is_content_addressed(name):
+    return bool(name) and DIGEST_NAME_RE.search(name) is not None
+
+
+def digest_name(directory, digest, original_name):
+    extension = os.path.splitext(original_name)[1].lower()
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save, совпадение имён - не конфликт.
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        digest = getattr(content, 'content_digest', None)
+        if digest and hasattr(content, 'temporary_file_path'):
+            return self._move_upload(content, digest_name(directory, digest, name))
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.path(directory), suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            name = digest_name(directory, digest.hexdigest(), name)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temp_path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def _move_upload(self, content, name):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Загрузка может лежать на другой файловой системе (tmpfs): файл
+        # сначала переносится или копируется во временный рядом с целью,
+        # и под своим именем появляется только целиком, через os.replace.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        os.close(fd)
+        try:
+            file_move_safe(content.temporary_file_path(), temp_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            # Одновременная загрузка той же картинки заменит файл таким же.
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+post_image_storage = ContentAddressedStorage()
@@ -0,0 +1,63 @@
+import logging
+from datetime import date
+
+from sorl.thumbnail import get_thumbnail
+
+from jobs.queue import task
+
+from .models import ArchiveMonth, Group, Post, TrendingPost, User
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра, которую показывают шаблоны ленты и записи.
+POST_THUMBNAIL = ('960x339', {'crop': 'center', 'upscale': True})
+
+
+@task
+def register_group_post(post_id, using):
+    post = Post.objects.using(using).filter(pk=post_id).only('group', 'text', 'pub_date').first()
+    if post is not None and post.group_id:
+        Group.register_post(post)
+
+
+@task
+def refresh_group_stats(group_ids):
+    Group.refresh_stats(group_ids)
+
+
+@task
+def count_archive_post(month, amount, author_id=None, group_id=None):
+    month = date.fromisoformat(month)
+    if author_id:
+        ArchiveMonth.add(month, amount, author_id=author_id)
+    if group_id:
+        ArchiveMonth.add(month, amount, group_id=group_id)
+
+
+@task
+def refresh_archive(author_ids=(), group_ids=()):
+    ArchiveMonth.refresh(author_ids, group_ids)
+
+
+@task
+def bump_trending(post_id, using):
+    TrendingPost.bump(post_id, using=using)
+
+
+@task
+def make_thumbnail(post_id, using):
+    post = Post.objects.using(using).filter(pk=post_id).only('image').first()
+    if post is not None and post.image:
+        geometry, options = POST_THUMBNAIL
+        get_thumbnail(post.image, geometry, **options)
+
+
+@task
+def delete_user(user_id):
+    from .moderation import delete_user_content
+
+    # Пользователя могли восстановить, пока задача ждала в очереди.
+    if User.objects.filter(pk=user_id, is_active=True).exists():
+        return
+    delete_user_content(user_id, progress=lambda stage, done: logger.info(
+        'Удаление пользователя %s: %s - %s', user_id, stage, done))
@@ -0,0 +1,24 @@
+from django import template
+
+register = template.Library()
+
+# Сколько соседних страниц показывать по обе стороны от текущей.
+PAGE_WINDOW = 2
+
+
+@register.filter
+def page_window(page):
+    """
+    Номера страниц для переключателя: первая, последняя и окно вокруг
+    текущей. None - пропуск между ними.
+    """
+    last = page.paginator.num_pages
+    start, end = max(page.number - PAGE_WINDOW, 1), min(page.number + PAGE_WINDOW, last)
+    numbers = []
+    for number in sorted({1, last, *range(start, end + 1)}):
+        if numbers and number - numbers[-1] == 2:
+            numbers.append(number - 1)
+        elif numbers and number - numbers[-1] > 2:
+            numbers.append(None)
+        numbers.append(number)
+    return numbers
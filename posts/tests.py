@@ -1,12 +1,62 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
-from django.urls import reverse
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.core.signals import request_finished, request_started
+from django.db import DatabaseError, close_old_connections, connection, router
+from django.db.models import Count, Max, Min
+from django.db.utils import ConnectionHandler
+from django.http import Http404, HttpResponse
+from django.template import engines
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from posts.archival import tiered_posts
+from posts.events import EVENTS_BUSY_RETRY, CacheBus, LocalBus, bus
+from posts.management.commands.serve import PooledWSGIServer, RequestHandler
+from posts.models import (ArchiveMonth, ArchivedComment, ArchivedPost, Comment, DigestRun, Follow,
+                          Group, Post, Recommendation, StoredImage, TrendingPost, User)
+from posts.moderation import deactivate_user, delete_user_content
+from posts.paginators import EXACT_COUNT_THRESHOLD, EstimatedCountPaginator, feed_generations
+from posts.recommendations import refresh_recommendations
+from posts.shards import shard_for_author, sharding_enabled
+from posts.storage import post_image_storage
+from posts.templatetags.pagination import page_window
+from yatube.mediafiles import serve_media
+from yatube.ratelimit import client_ip, rate_limit
+from yatube.routers import ReplicaRoutingMiddleware, replica_databases
+from yatube.staticfiles import serve_static
+from yatube.testing import ImmediateOnCommit
 
-from posts.models import Comment, Follow, Group, Post, User
 
+@override_settings(JOBS_EAGER=True, RATE_LIMITS_ENABLED=False)
+class YatubeTestCase(ImmediateOnCommit, TestCase):
+    # Записи могут лежать в шардах (POST_SHARD_DATABASE_URLS),
+    # фоновые задачи выполняются сразу, лимиты запросов выключены.
+    databases = '__all__'
 
-class TestPosts(TestCase):
+
+class TestPosts(YatubeTestCase):
     def setUp(self) -> None:
         self.client = Client()
         self.user = User.objects.create_user(
@@ -135,7 +185,7 @@ class TestPosts(TestCase):
         self.assertFalse(Comment.objects.exists())
 
 
-class TestImage(TestCase):
+class TestImage(YatubeTestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(
             username='TestUser',
@@ -187,7 +237,7 @@ class TestImage(TestCase):
                              )
 
 
-class TestCache(TestCase):
+class TestCache(YatubeTestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(
             username='TestUser',
@@ -213,7 +263,7 @@ class TestCache(TestCase):
         self.assertEqual(response.context['page'][0].text, text)
 
 
-class TestFollow(TestCase):
+class TestFollow(YatubeTestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(
             username='TestUser',
@@ -258,3 +308,1222 @@ class TestFollow(TestCase):
         Post.objects.create(author=self.user, text='TestText', group=self.group)
         response = self.client.get(reverse('follow_index'))
         self.assertEqual(response.context['paginator'].count, 0)
+
+    def test_follow_twice_single_statement(self):
+        url = reverse('profile_follow', kwargs={'username': self.user.username})
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            Follow.objects.follow(self.myself_user, self.user)
+        self.client.get(url)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_unfollow_not_followed(self):
+        with self.assertNumQueries(1):
+            deleted = Follow.objects.unfollow(self.myself_user, self.user)
+        self.assertEqual(deleted, 0)
+
+    def test_follow_bulk_import_export(self):
+        authors = [
+            User.objects.create_user(username=f'Author{i}') for i in range(5)
+        ]
+        usernames = ' '.join(author.username for author in authors)
+        response = self.client.post(reverse('follow_bulk'),
+                                    data={'authors': f'{usernames} MySelfUser Unknown'})
+        self.assertRedirects(response, reverse('follow_index'))
+        self.assertEqual(self.myself_user.follower.count(), 5)
+        response = self.client.get(reverse('follow_bulk'))
+        self.assertEqual(response.content.decode().split(), sorted(usernames.split()))
+
+
+class TestRecommendations(YatubeTestCase):
+    def setUp(self) -> None:
+        self.reader = User.objects.create_user(username='Reader')
+        self.friend = User.objects.create_user(username='Friend')
+        self.stranger = User.objects.create_user(username='Stranger')
+        Follow.objects.create(user=self.reader, author=self.friend)
+        Follow.objects.create(user=self.friend, author=self.stranger)
+        self.client.force_login(self.reader)
+
+    def test_friends_of_friends(self):
+        refresh_recommendations()
+        authors = Recommendation.objects.filter(user=self.reader).values_list('author', flat=True)
+        self.assertEqual(list(authors), [self.stranger.pk])
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, '@Stranger')
+
+    def test_incremental_refresh(self):
+        self.assertEqual(refresh_recommendations(), 2)
+        self.assertEqual(refresh_recommendations(), 0)
+        Follow.objects.unfollow(self.reader, self.friend)
+        refresh_recommendations()
+        self.assertFalse(Recommendation.objects.filter(user=self.reader).exists())
+
+    def test_incremental_refresh_updates_co_followers(self):
+        other = User.objects.create_user(username='Other')
+        writer = User.objects.create_user(username='Writer')
+        Follow.objects.create(user=other, author=self.friend)
+        refresh_recommendations()
+        # Other не подписан на Reader, но учитывает его как читателя Friend.
+        Follow.objects.create(user=self.reader, author=writer)
+        refresh_recommendations()
+        authors = Recommendation.objects.filter(user=other).values_list('author', flat=True)
+        self.assertIn(writer.pk, authors)
+
+
+class TestTrending(YatubeTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='TestUser')
+        self.quiet = Post.objects.create(author=self.user, text='Quiet')
+        self.popular = Post.objects.create(author=self.user, text='Popular')
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_comments_rank_posts(self):
+        Comment.objects.create(post=self.quiet, author=self.user, text='One')
+        for _ in range(3):
+            Comment.objects.create(post=self.popular, author=self.user, text='More')
+        self.assertEqual(TrendingPost.objects.get(post=self.popular).score, 3)
+        response = self.client.get(reverse('trending'))
+        self.assertEqual(list(response.context['page']), [self.popular, self.quiet])
+
+    def test_decay(self):
+        Comment.objects.create(post=self.quiet, author=self.user, text='One')
+        Comment.objects.create(post=self.popular, author=self.user, text='Two')
+        Comment.objects.create(post=self.popular, author=self.user, text='Three')
+        call_command('decay_trending', factor=0.5, min_score=0.75, stdout=StringIO())
+        self.assertEqual(list(TrendingPost.objects.values_list('post', 'score')),
+                         [(self.popular.pk, 1.0)])
+
+
+class TestGroupIndex(YatubeTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='TestUser')
+        self.group = Group.objects.create(title='First', slug='first', description='-')
+        self.other = Group.objects.create(title='Second', slug='second', description='-')
+
+    def test_stats_follow_posts(self):
+        old = Post.objects.create(author=self.user, text='Old', group=self.group)
+        new = Post.objects.create(author=self.user, text='New', group=self.group)
+        self.group.refresh_from_db()
+        self.assertEqual((self.group.post_count, self.group.last_post_title), (2, 'New'))
+
+        new = Post.objects.get(pk=new.pk)
+        new.group = self.other
+        new.save()
+        old.delete()
+        self.group.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.group.post_count, self.group.last_post_date), (0, None))
+        self.assertEqual((self.other.post_count, self.other.last_post_title), (1, 'New'))
+
+    def test_edit_refreshes_only_latest_post(self):
+        old = Post.objects.create(author=self.user, text='Old', group=self.group)
+        new = Post.objects.create(author=self.user, text='New', group=self.group)
+        with mock.patch('posts.tasks.Group.refresh_stats') as refresh_stats:
+            old.text = 'Old, edited'
+            old.save()
+        refresh_stats.assert_not_called()
+
+        new.text = 'New, edited'
+        new.save()
+        self.group.refresh_from_db()
+        self.assertEqual((self.group.post_count, self.group.last_post_title), (2, 'New, edited'))
+
+    def test_group_index(self):
+        Post.objects.create(author=self.user, text='Hello', group=self.group)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('group_index'))
+        self.assertContains(response, 'Hello')
+        self.assertContains(response, reverse('group', kwargs={'slug': self.other.slug}))
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+@mock.patch('yatube.routers.replica_databases', return_value=['replica_1'])
+class TestReplicaRouting(YatubeTestCase):
+    def request(self, method, url, write=False, cookies=None):
+        request = getattr(RequestFactory(), method)(url)
+        request.resolver_match = resolve(url)
+        request.COOKIES.update(cookies or {})
+        used = []
+
+        def view(request):
+            middleware.process_view(request, view, (), {})
+            if write:
+                router.db_for_write(Group)
+            used.append(router.db_for_read(Group) or 'default')
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        response = middleware(request)
+        return used[0], response
+
+    def test_read_views_use_replica(self, replicas):
+        self.assertEqual(self.request('get', '/')[0], 'replica_1')
+        self.assertEqual(self.request('get', '/new/')[0], 'default')
+        self.assertEqual(self.request('post', '/')[0], 'default')
+
+    def test_reads_pinned_after_write(self, replicas):
+        used, response = self.request('post', '/new/', write=True)
+        self.assertEqual(used, 'default')
+        cookie = response.cookies['primary_pin'].value
+        used, _ = self.request('get', '/', cookies={'primary_pin': cookie})
+        self.assertEqual(used, 'default')
+        self.assertEqual(self.request('get', '/', cookies={'primary_pin': '0'})[0], 'replica_1')
+
+
+class TestReplicaDatabases(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = os.path.join(directory, 'primary.sqlite3')
+        replica = os.path.join(directory, 'replica.sqlite3')
+        self.connections = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': primary},
+            'replica_1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': replica},
+            'replica_2': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': primary},
+        })
+        self.addCleanup(self.connections.close_all)
+        patcher = mock.patch('yatube.routers.connections', self.connections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(REPLICA_DATABASES=['replica_1', 'replica_2'])
+    def test_replica_on_other_database_is_used(self):
+        self.assertEqual(replica_databases(), ['replica_1'])
+        with self.connections['replica_1'].cursor() as cursor:
+            cursor.execute('CREATE TABLE marker (id integer)')
+        with self.connections['default'].cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'marker'")
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    @override_settings(REPLICA_DATABASES=['replica_1'])
+    def test_same_name_on_other_host_is_replica(self):
+        postgres = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'yatube',
+                    'HOST': 'primary.db', 'PORT': '5432'}
+        self.connections['default'].settings_dict.update(postgres)
+        self.connections['replica_1'].settings_dict.update(postgres, HOST='replica.db')
+        self.assertEqual(replica_databases(), ['replica_1'])
+        self.connections['replica_1'].settings_dict['HOST'] = 'primary.db'
+        self.assertEqual(replica_databases(), [])
+
+
+@skipUnless(sharding_enabled(), 'нужны шарды в POST_SHARD_DATABASE_URLS')
+class TestSharding(YatubeTestCase):
+    def setUp(self) -> None:
+        self.group = Group.objects.create(title='Shared', slug='shared', description='-')
+        self.authors = [User.objects.create_user(username=f'Author{i}') for i in range(4)]
+        self.posts = [
+            Post.objects.create(author=author, text=f'Text {number}', group=self.group)
+            for number, author in enumerate(self.authors * 3)
+        ]
+        cache.clear()
+
+    def test_posts_live_in_author_shard(self):
+        shards = {post._state.db for post in self.posts}
+        self.assertGreater(len(shards), 1)
+        for post in self.posts:
+            self.assertEqual(post._state.db, shard_for_author(post.author_id))
+        post = self.posts[5]
+        response = self.client.get(reverse(
+            'post', kwargs={'username': post.author.username, 'post_id': post.id}))
+        self.assertEqual(response.context['selected_post'], post)
+
+    def test_feeds_merge_shards_by_date(self):
+        newest_first = [post.text for post in reversed(self.posts)]
+        for url in (reverse('index'), reverse('group', kwargs={'slug': self.group.slug})):
+            response = self.client.get(url)
+            self.assertEqual(response.context['paginator'].count, len(self.posts))
+            self.assertEqual([post.text for post in response.context['page']],
+                             newest_first[:10])
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual([post.text for post in response.context['page']],
+                             newest_first[10:])
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, len(self.posts))
+
+    def test_unmergeable_queries_refused(self):
+        with self.assertRaises(NotImplementedError):
+            list(Post.objects.order_by('author__username'))
+        with self.assertRaises(NotImplementedError):
+            list(Post.objects.values_list('text', flat=True))
+        self.assertEqual(len(Post.objects.order_by('?')), len(self.posts))
+
+        stats = Post.objects.aggregate(Count('pk'), first=Min('pub_date'), last=Max('pub_date'))
+        self.assertEqual(stats, {'pk__count': len(self.posts),
+                                 'first': self.posts[0].pub_date,
+                                 'last': self.posts[-1].pub_date})
+        with self.assertRaises(NotImplementedError):
+            Post.objects.aggregate(Count('group', distinct=True))
+
+    def test_ids_unique_across_shards(self):
+        comments = [Comment.objects.create(post=post, author=post.author, text=post.text)
+                    for post in self.posts]
+        self.assertEqual(len({post.pk for post in self.posts}), len(self.posts))
+        self.assertEqual(len({comment.pk for comment in comments}), len(comments))
+        # Выборки комментариев без фильтра по записи читают все шарды.
+        self.assertEqual(Comment.objects.count(), len(comments))
+        self.assertEqual(Comment.objects.first(), comments[-1])
+        self.assertEqual(Comment.objects.get(pk=comments[5].pk).text, 'Text 5')
+        self.assertEqual(Comment.objects.filter(text='Text 6').get(), comments[6])
+
+    def test_new_post_form_saves_to_author_shard(self):
+        # Сообщество из основной базы присваивается раньше автора.
+        author = next(author for author in self.authors
+                      if shard_for_author(author.pk) != 'default')
+        self.client.force_login(author)
+        self.client.post(reverse('new_post'), {'text': 'From form', 'group': self.group.pk})
+        post = Post.objects.get(text='From form')
+        self.assertEqual(post._state.db, shard_for_author(author.pk))
+        self.assertFalse(Post.objects.using('default').filter(text='From form').exists())
+
+
+class TestDigest(YatubeTestCase):
+    def setUp(self) -> None:
+        self.author = User.objects.create_user(username='Author')
+        self.readers = [
+            User.objects.create_user(username=f'Reader{i}', email=f'reader{i}@test.com')
+            for i in range(3)
+        ]
+        for reader in self.readers:
+            Follow.objects.follow(reader, self.author)
+        Post.objects.create(author=self.author, text='Fresh news')
+
+    def test_digest_sent_once_per_follower(self):
+        call_command('send_digests', chunk_size=2, stdout=StringIO())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         [reader.email for reader in self.readers])
+        self.assertIn('Fresh news', mail.outbox[0].body)
+        self.assertIn('/Author/', mail.outbox[0].body)
+
+        mail.outbox.clear()
+        call_command('send_digests', stdout=StringIO())
+        self.assertEqual(mail.outbox, [])
+
+    def test_interrupted_digest_resumes(self):
+        run = DigestRun.objects.create(since=self.author.date_joined, until=timezone.now(),
+                                       cursor=self.readers[1].pk)
+        call_command('send_digests', stdout=StringIO())
+        self.assertEqual([message.to[0] for message in mail.outbox], [self.readers[2].email])
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished)
+
+
+class TestAdmin(YatubeTestCase):
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(title='Test group', slug='test-group')
+        self.author = User.objects.create_user(username='Author')
+
+    def changelist_queries(self, model_name):
+        url = reverse(f'admin:posts_{model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_readers(self, names):
+        for name in names:
+            reader = User.objects.create_user(username=name)
+            post = Post.objects.create(author=reader, group=self.group, text=f'Post {name}')
+            Comment.objects.create(post=post, author=reader, text='Comment')
+            Follow.objects.follow(reader, self.author)
+        cache.clear()
+
+    def test_changelists_do_not_grow_with_rows(self):
+        # Авторов хватает, чтобы данные были на каждом шарде.
+        self.add_readers(f'Reader{i}' for i in range(4))
+        before = {name: self.changelist_queries(name) for name in ('post', 'comment', 'follow')}
+        self.add_readers(f'Reader{i}' for i in range(4, 12))
+        after = {name: self.changelist_queries(name) for name in ('post', 'comment', 'follow')}
+        self.assertEqual(before, after)
+
+    def test_comment_changelist_counts_all_shards(self):
+        self.add_readers(f'Reader{i}' for i in range(4))
+        response = self.client.get(reverse('admin:posts_comment_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 4)
+        self.assertEqual(len(response.context['cl'].result_list), 4)
+        with mock.patch('posts.paginators.planner_rows', return_value=EXACT_COUNT_THRESHOLD):
+            paginator = EstimatedCountPaginator(Comment.objects.all(), 10)
+            self.assertEqual(paginator.count, EXACT_COUNT_THRESHOLD * len(settings.POST_SHARDS))
+
+    def test_search_and_date_filter(self):
+        Post.objects.create(author=self.author, text='Needle in a haystack')
+        Post.objects.create(author=self.author, text='Something else')
+        url = reverse('admin:posts_post_changelist')
+        response = self.client.get(url, {'q': 'Needle'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.client.get(url, {'pub_date__gte': since})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        for url in (url, reverse('admin:posts_comment_changelist')):
+            self.assertIsNone(self.client.get(url).context['cl'].date_hierarchy)
+
+
+class TestModeration(YatubeTestCase):
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.client.force_login(self.admin)
+        self.spammer = User.objects.create_user(username='Spammer')
+        self.author = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.duplicate = Group.objects.create(title='Duplicate', slug='duplicate')
+        self.target = Group.objects.create(title='Target', slug='target')
+        for i in range(5):
+            post = Post.objects.create(author=self.spammer, group=self.group, text=f'Spam {i}')
+            Comment.objects.create(post=post, author=self.author, text='Reply')
+        Post.objects.create(author=self.author, group=self.duplicate, text='Legit')
+
+    def post_counts(self):
+        return dict(Group.objects.order_by('slug').values_list('slug', 'post_count'))
+
+    def feed_count(self, url):
+        return self.client.get(url).context['page'].paginator.count
+
+    def test_move_posts_command(self):
+        out = StringIO()
+        call_command('move_posts', 'target', '--from-group', 'group', '--chunk-size', '2',
+                     stdout=out)
+        self.assertIn('Перенесено записей: 5', out.getvalue())
+        self.assertEqual(self.target.posts.count(), 5)
+        self.assertEqual(self.post_counts(), {'duplicate': 1, 'group': 0, 'target': 5})
+
+    def test_merge_groups_admin_action(self):
+        response = self.client.post(reverse('admin:posts_group_changelist'), {
+            'action': 'merge_into_group',
+            '_selected_action': [self.group.pk, self.duplicate.pk],
+            'group': self.target.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.post_counts(), {'target': 6})
+
+    def test_move_to_group_requires_group(self):
+        selected = list(Post.objects.filter(author_id=self.spammer.pk)
+                        .values_list('pk', flat=True))
+        response = self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'move_to_group',
+            '_selected_action': selected,
+            'group': '',
+        }, follow=True)
+        self.assertContains(response, 'Выберите сообщество, в которое перенести')
+        self.assertEqual(Post.objects.filter(group_id=self.group.pk).count(), 5)
+
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'move_to_group',
+            '_selected_action': selected,
+            'group': self.target.pk,
+        })
+        self.assertEqual(Post.objects.filter(group_id=self.target.pk).count(), 5)
+
+    def test_delete_spam_admin_action(self):
+        selected = list(Post.objects.filter(author_id=self.spammer.pk)
+                        .values_list('pk', flat=True)[:3])
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'delete_spam',
+            '_selected_action': selected,
+        })
+        self.assertEqual(Post.objects.filter(author_id=self.spammer.pk).count(), 2)
+        self.assertEqual(self.post_counts()['group'], 2)
+
+    def test_delete_posts_command_removes_comments(self):
+        call_command('delete_posts', 'Spammer', '--chunk-size', '2', stdout=StringIO())
+        self.assertFalse(Post.objects.filter(author_id=self.spammer.pk).exists())
+        self.assertFalse(Comment.objects.using(shard_for_author(self.spammer.pk))
+                         .filter(author=self.author).exists())
+        self.assertEqual(self.post_counts(), {'duplicate': 1, 'group': 0, 'target': 0})
+
+    def test_failed_chunk_keeps_comments(self):
+        with mock.patch('posts.moderation.delete_rows', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                call_command('delete_posts', 'Spammer', stdout=StringIO())
+        self.assertEqual(Comment.objects.using(shard_for_author(self.spammer.pk))
+                         .filter(author=self.author).count(), 5)
+
+    def test_archived_posts_merged_and_deleted(self):
+        old = timezone.now() - timedelta(days=3 * 365)
+        spam = Post.objects.filter(author_id=self.spammer.pk).order_by('pk').first()
+        Post.objects.filter(author_id=self.spammer.pk, pk=spam.pk).update(pub_date=old)
+        Post.objects.filter(author_id=self.author.pk).update(pub_date=old)
+        call_command('archive_posts', stdout=StringIO())
+        self.assertEqual(ArchivedPost.objects.count(), 2)
+        cache.clear()
+        self.assertEqual(self.feed_count('/group/target/'), 0)
+
+        call_command('merge_groups', 'target', 'group', 'duplicate', stdout=StringIO())
+        self.assertEqual(ArchivedPost.objects.filter(group_id=self.target.pk).count(), 2)
+        self.assertEqual(self.post_counts(), {'target': 6})
+        self.assertEqual(self.feed_count('/group/target/'), 6)
+        month = timezone.localtime(old).date().replace(day=1)
+        self.assertEqual(ArchiveMonth.objects.get(group=self.target, month=month).post_count, 2)
+
+        call_command('delete_posts', 'Spammer', stdout=StringIO())
+        self.assertFalse(ArchivedPost.objects.filter(author_id=self.spammer.pk).exists())
+        self.assertFalse(ArchivedComment.objects.using(shard_for_author(self.spammer.pk))
+                         .exists())
+        self.assertEqual(self.post_counts(), {'target': 1})
+        self.assertEqual(self.feed_count('/group/target/'), 1)
+
+
+class TestUserDeletion(YatubeTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='Prolific', password='password')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.posts = [Post.objects.create(author=self.user, group=self.group, text=f'Post {i}')
+                      for i in range(5)]
+        other_post = Post.objects.create(author=self.reader, text='Reader post')
+        Comment.objects.create(post=self.posts[0], author=self.reader, text='Reply')
+        Comment.objects.create(post=other_post, author=self.user, text='Own comment')
+        Follow.objects.follow(self.reader, self.user)
+        Follow.objects.follow(self.user, self.reader)
+        Recommendation.objects.create(user=self.reader, author=self.user, score=1)
+
+    def test_user_hidden_before_deletion(self):
+        feeds = {reverse('group', kwargs={'slug': 'group'}): 0, reverse('follow_index'): 0}
+        self.client.force_login(self.reader)
+        for url in feeds:
+            self.assertContains(self.client.get(url), 'Post 0')
+        with override_settings(JOBS_EAGER=False):
+            call_command('delete_user', 'Prolific', stdout=StringIO())
+        for url, count in feeds.items():
+            response = self.client.get(url)
+            self.assertNotContains(response, 'Post 0')
+            self.assertEqual(response.context['paginator'].count, count)
+        # Главная закэширована целиком на 20 секунд.
+        cache.clear()
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Post 0')
+        self.assertEqual(response.context['paginator'].count, 1)
+        self.client.logout()
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(self.client.get('/Prolific/').status_code, 404)
+        post_url = reverse('post', kwargs={'username': 'Prolific',
+                                           'post_id': self.posts[0].pk})
+        self.assertEqual(self.client.get(post_url).status_code, 404)
+        self.assertFalse(self.client.login(username='Prolific', password='password'))
+
+    def test_followers_feeds_reset(self):
+        generation = f'follower:{self.reader.pk}'
+        before = feed_generations([generation])
+        with override_settings(JOBS_EAGER=False):
+            deactivate_user(self.user)
+        after_deactivation = feed_generations([generation])
+        self.assertNotEqual(after_deactivation, before)
+        delete_user_content(self.user.pk)
+        self.assertNotEqual(feed_generations([generation]), after_deactivation)
+
+    def test_deletion_removes_all_rows(self):
+        out = StringIO()
+        call_command('delete_user', 'Prolific', '--now', '--chunk-size', '2', stdout=out)
+        self.assertIn('posts: удалено 5', out.getvalue())
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Post.objects.filter(author_id=self.user.pk).exists())
+        self.assertFalse(Comment.objects.using(shard_for_author(self.reader.pk))
+                         .filter(author_id=self.user.pk).exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(Recommendation.objects.exists())
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 0)
+
+    def test_admin_action_deletes_in_background(self):
+        admin = User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.client.force_login(admin)
+        self.client.post(reverse('admin:auth_user_changelist'), {
+            'action': 'delete_in_background',
+            '_selected_action': [self.user.pk],
+        })
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertTrue(Post.objects.filter(author_id=self.reader.pk).exists())
+
+
+class TestArchive(YatubeTestCase):
+    def setUp(self) -> None:
+        self.author = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.other_group = Group.objects.create(title='Other', slug='other')
+        self.posts = [Post.objects.create(author=self.author, group=self.group, text=f'Post {i}')
+                      for i in range(3)]
+        self.month = timezone.localtime(self.posts[0].pub_date).date().replace(day=1)
+
+    def counts(self, **lookup):
+        return dict(ArchiveMonth.objects.filter(**lookup).values_list('month', 'post_count'))
+
+    def test_counts_follow_post_changes(self):
+        self.assertEqual(self.counts(author=self.author), {self.month: 3})
+        self.assertEqual(self.counts(group=self.group), {self.month: 3})
+
+        post = Post.objects.filter(author_id=self.author.pk).first()
+        post.group = self.other_group
+        post.save()
+        Post.objects.filter(author_id=self.author.pk).last().delete()
+        self.assertEqual(self.counts(author=self.author), {self.month: 2})
+        self.assertEqual(self.counts(group=self.group), {self.month: 1})
+        self.assertEqual(self.counts(group=self.other_group), {self.month: 1})
+
+    def test_archive_pages(self):
+        old_date = timezone.now().replace(year=2019, month=3, day=15)
+        Post.objects.filter(author_id=self.author.pk, pk=self.posts[0].pk).update(
+            pub_date=old_date)
+        call_command('refresh_archive', stdout=StringIO())
+        self.assertEqual(self.counts(group=self.group)[date(2019, 3, 1)], 1)
+
+        for url in ('/Author/archive/2019/3/', '/group/group/archive/2019/3/'):
+            response = self.client.get(url)
+            self.assertEqual([post.text for post in response.context['page']], ['Post 0'])
+            self.assertContains(response, f'archive/{self.month.year}/{self.month.month}/')
+        response = self.client.get('/Author/')
+        self.assertEqual(len(response.context['archive_months']), 2)
+        self.assertEqual(self.client.get('/Author/archive/2019/13/').status_code, 404)
+        self.assertEqual(self.client.get('/Author/archive/9999/12/').status_code, 404)
+
+
+class TestColdArchive(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.posts = [Post.objects.create(author=self.author, group=self.group, text=f'Post {i}')
+                      for i in range(12)]
+        old_post = self.posts[0]
+        Comment.objects.create(post=old_post, author=self.author, text='Old comment')
+        # Две самые ранние записи - старше трёх лет.
+        for days, post in enumerate(self.posts[:2]):
+            Post.objects.filter(author_id=self.author.pk, pk=post.pk).update(
+                pub_date=timezone.now() - timedelta(days=3 * 365 - days))
+
+    def test_archive_and_restore(self):
+        call_command('archive_posts', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author_id=self.author.pk).count(), 10)
+        self.assertEqual(ArchivedPost.objects.filter(author_id=self.author.pk).count(), 2)
+        self.assertEqual(ArchivedComment.objects.using(shard_for_author(self.author.pk))
+                         .get().post_id, self.posts[0].pk)
+
+        call_command('archive_posts', '--restore', '--all', stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author_id=self.author.pk).count(), 12)
+        self.assertFalse(ArchivedPost.objects.exists())
+        self.assertEqual(self.posts[0].comments.get().text, 'Old comment')
+
+    def test_archived_posts_are_served(self):
+        call_command('archive_posts', stdout=StringIO())
+        old_post = self.posts[0]
+        response = self.client.get(reverse('post', kwargs={'username': 'Author',
+                                                           'post_id': old_post.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Old comment')
+
+        for url in ('/', '/group/group/'):
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual(response.context['paginator'].count, 12)
+            self.assertEqual([post.text for post in response.context['page']],
+                             ['Post 1', 'Post 0'])
+        response = self.client.get('/Author/', {'page': 2})
+        self.assertEqual([post.text for post in response.context['page']],
+                         ['Post 5', 'Post 4', 'Post 3', 'Post 2', 'Post 1', 'Post 0'])
+
+        self.group.refresh_from_db()
+        Group.refresh_stats([self.group.pk])
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 12)
+
+
+class TestStaticFiles(TestCase):
+    def setUp(self) -> None:
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.source, 'css'))
+        self.css = b'body { color: black; }\n' * 50
+        with open(os.path.join(self.source, 'css', 'site.css'), 'wb') as css:
+            css.write(self.css)
+        settings = override_settings(
+            STATICFILES_DIRS=[self.source],
+            STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATICFILES_STORAGE='yatube.staticfiles.PrecompressedManifestStorage',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed_name = staticfiles_storage.stored_name('css/site.css')
+        self.factory = RequestFactory()
+
+    def test_hashed_file_served_precompressed(self):
+        self.assertNotEqual(self.hashed_name, 'css/site.css')
+        self.assertTrue(os.path.exists(os.path.join(self.root, self.hashed_name + '.gz')))
+
+        request = self.factory.get('/static/', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        response = serve_static(request, self.hashed_name)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.css)
+
+    def test_plain_and_unhashed_files(self):
+        response = serve_static(self.factory.get('/static/'), 'css/site.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), self.css)
+        with self.assertRaises(Http404):
+            serve_static(self.factory.get('/static/'), '../' + os.path.basename(self.source))
+
+
+class TestFlatpages(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.site = Site.objects.get_current()
+        self.page = FlatPage.objects.create(url='/about-us/', title='Об авторе',
+                                            content='<p>Текст страницы</p>')
+        self.page.sites.add(self.site)
+
+    def test_anonymous_page_served_from_memory(self):
+        response = self.client.get('/about-us/')
+        self.assertContains(response, '<p>Текст страницы</p>')
+        with self.assertNumQueries(0):
+            response = self.client.get('/about-us/')
+        self.assertContains(response, 'Текст страницы')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/about-us/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_saved_page_invalidated(self):
+        self.client.get('/about-us/')
+        self.page.content = 'Новый текст'
+        self.page.save()
+        self.assertContains(self.client.get('/about-us/'), 'Новый текст')
+        self.page.sites.clear()
+        self.assertEqual(self.client.get('/about-us/').status_code, 404)
+
+    def test_authenticated_page_shows_username(self):
+        self.client.get('/about-us/')
+        user = User.objects.create_user(username='Reader')
+        self.client.force_login(user)
+        self.client.get('/about-us/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/about-us/')
+        self.assertContains(response, 'Пользователь: Reader')
+
+
+@override_settings(RATE_LIMITS_ENABLED=True)
+class TestRateLimit(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='Writer')
+        self.client.force_login(self.user)
+
+    def test_new_post_limited_per_user(self):
+        for i in range(5):
+            response = self.client.post(reverse('new_post'), {'text': f'Запись {i}'})
+            self.assertEqual(response.status_code, 302)
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('new_post'), {'text': 'Лишняя запись'})
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 5)
+
+        other = Client()
+        other.force_login(User.objects.create_user(username='Other'))
+        response = other.post(reverse('new_post'), {'text': 'Другой автор'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_limit_per_ip(self):
+        view = rate_limit('test', ip='2/h')(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        for address, expected in (('10.0.0.1', 200), ('10.0.0.1', 200),
+                                  ('10.0.0.1', 429), ('10.0.0.2', 200)):
+            request = factory.post('/', REMOTE_ADDR=address)
+            request.user = self.user
+            self.assertEqual(view(request).status_code, expected)
+        # GET в этом представлении не ограничен.
+        request = factory.get('/', REMOTE_ADDR='10.0.0.1')
+        request.user = self.user
+        self.assertEqual(view(request).status_code, 200)
+
+    def test_no_burst_at_window_boundary(self):
+        view = rate_limit('test', user='2/m')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().post('/')
+        request.user = self.user
+        for now, expected in ((59.5, 200), (59.9, 200), (60.1, 429), (60.5, 429), (90.2, 200)):
+            with mock.patch('yatube.ratelimit.time.time', return_value=now):
+                self.assertEqual(view(request).status_code, expected)
+
+    def test_user_limit_checked_before_ip(self):
+        view = rate_limit('test', user='1/h', ip='2/h')(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        other = User.objects.create_user(username='Other')
+        for user, expected in ((self.user, 200), (self.user, 429), (self.user, 429),
+                               (other, 200)):
+            request = factory.post('/', REMOTE_ADDR='10.0.0.1')
+            request.user = user
+            self.assertEqual(view(request).status_code, expected)
+
+    @override_settings(TRUSTED_PROXIES=['10.1.0.0/16'])
+    def test_client_ip_behind_trusted_proxy(self):
+        factory = RequestFactory()
+        for remote, forwarded, expected in (
+                ('10.1.0.5', '203.0.113.7', '203.0.113.7'),
+                ('10.1.0.5', '1.2.3.4, 203.0.113.7, 10.1.0.9', '203.0.113.7'),
+                ('203.0.113.8', '1.2.3.4', '203.0.113.8'),
+                ('10.1.0.5', '', '10.1.0.5')):
+            request = factory.get('/', REMOTE_ADDR=remote, HTTP_X_FORWARDED_FOR=forwarded)
+            self.assertEqual(client_ip(request), expected)
+
+
+class TestPrerenderedText(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='Writer')
+        self.long_text = 'Начало <b>записи</b>\nвторая строка ' + 'слово ' * 200 + 'КОНЕЦ'
+        self.post = Post.objects.create(text=self.long_text, author=self.user)
+
+    def test_html_rendered_on_save(self):
+        self.assertTrue(self.post.text_html.startswith(
+            'Начало &lt;b&gt;записи&lt;/b&gt;<br>вторая строка'))
+        self.assertIn('КОНЕЦ', self.post.text_html)
+        self.assertNotIn('КОНЕЦ', self.post.excerpt)
+        self.assertLessEqual(len(self.post.excerpt), 600)
+
+        self.post.text = 'Короткий\nтекст'
+        self.post.save(update_fields=['text'])
+        post = Post.objects.get(author=self.user)
+        self.assertEqual(post.text_html, 'Короткий<br>текст')
+        self.assertEqual(post.excerpt, 'Короткий<br>текст')
+
+    def test_lists_show_excerpt_and_post_shows_full_text(self):
+        response = self.client.get(reverse('profile', kwargs={'username': 'Writer'}))
+        self.assertContains(response, 'Начало &lt;b&gt;записи&lt;/b&gt;<br>вторая строка')
+        self.assertNotContains(response, 'КОНЕЦ')
+        self.assertIn('text', response.context['page'][0].get_deferred_fields())
+
+        response = self.client.get(reverse('post', kwargs={'username': 'Writer',
+                                                           'post_id': self.post.pk}))
+        self.assertContains(response, 'КОНЕЦ')
+
+    def test_render_posts_backfills_old_rows(self):
+        Post.objects.filter(author=self.user).update(text_html='', excerpt='')
+        Post.objects.create(text='Вторая', author=self.user)
+        call_command('render_posts', chunk_size=1, stdout=StringIO())
+        posts = Post.objects.filter(author=self.user).order_by('pk')
+        self.assertIn('КОНЕЦ', posts[0].text_html)
+        self.assertEqual(posts[1].excerpt, 'Вторая')
+
+
+class TestImageStorage(YatubeTestCase):
+    gif = (b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21'
+           b'\xf9\x04\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00'
+           b'\x01\x00\x00\x02\x02\x4c\x01\x00\x3b')
+
+    def setUp(self) -> None:
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='Uploader')
+
+    def create_post(self, filename):
+        return Post.objects.create(author=self.user, text=filename,
+                                   image=SimpleUploadedFile(filename, self.gif, 'image/gif'))
+
+    def test_same_content_stored_once(self):
+        with mock.patch('posts.tasks.get_thumbnail') as get_thumbnail:
+            first = self.create_post('meme.GIF')
+            second = self.create_post('copy_of_meme.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.gif$')
+        self.assertEqual(os.listdir(os.path.dirname(first.image.path)),
+                         [os.path.basename(first.image.name)])
+        self.assertEqual(StoredImage.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(get_thumbnail.call_count, 1)
+
+    def test_unreferenced_image_pruned(self):
+        first = self.create_post('meme.gif')
+        second = self.create_post('meme.gif')
+        path = first.image.path
+        first.delete()
+        self.assertEqual(StoredImage.objects.get(name=second.image.name).refcount, 1)
+        call_command('prune_images', '--hours', '0', stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+        call_command('delete_posts', 'Uploader', stdout=StringIO())
+        self.assertEqual(StoredImage.objects.get(name=second.image.name).refcount, 0)
+        call_command('prune_images', '--hours', '0', stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredImage.objects.exists())
+
+
+class TestBoundedUpload(YatubeTestCase):
+    gif = TestImageStorage.gif
+
+    def setUp(self) -> None:
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='Uploader')
+        self.client.force_login(self.user)
+
+    def upload(self, content):
+        return self.client.post(reverse('new_post'), {
+            'text': 'Запись с картинкой',
+            'image': SimpleUploadedFile('picture.gif', content, 'image/gif'),
+        })
+
+    def test_upload_moved_under_streamed_digest(self):
+        with mock.patch('posts.tasks.get_thumbnail'):
+            response = self.upload(self.gif)
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(author=self.user)
+        digest = hashlib.sha256(self.gif).hexdigest()
+        self.assertEqual(post.image.name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        with open(post.image.path, 'rb') as stored:
+            self.assertEqual(stored.read(), self.gif)
+
+    def test_upload_from_other_filesystem_and_existing_target(self):
+        digest = hashlib.sha256(self.gif).hexdigest()
+        name = f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif'
+        # os.rename между файловыми системами не работает, и файл копируется.
+        with mock.patch('posts.tasks.get_thumbnail'), \
+                mock.patch('django.core.files.move.os.rename', side_effect=OSError):
+            self.assertEqual(self.upload(self.gif).status_code, 302)
+        # Одновременная загрузка той же картинки: файла ещё не было при проверке.
+        exists = os.path.exists
+        with mock.patch('posts.tasks.get_thumbnail'), \
+                mock.patch('posts.storage.os.path.exists',
+                           lambda path: not path.endswith('.gif') and exists(path)):
+            self.assertEqual(self.upload(self.gif).status_code, 302)
+        self.assertEqual(Post.objects.filter(author=self.user, image=name).count(), 2)
+        directory = os.path.dirname(post_image_storage.path(name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(name)])
+        with open(post_image_storage.path(name), 'rb') as stored:
+            self.assertEqual(stored.read(), self.gif)
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=16)
+    def test_too_large_file_rejected(self):
+        response = self.upload(self.gif)
+        self.assertFormError(response, 'form', 'image', 'Файл больше 16\xa0bytes')
+        self.assertFalse(Post.objects.exists())
+
+    def test_decompression_bomb_rejected_by_header(self):
+        # Заголовок GIF обещает 65535x65535 пикселей при паре байт данных.
+        bomb = self.gif[:6] + b'\xff\xff\xff\xff' + self.gif[10:]
+        response = self.upload(bomb)
+        self.assertFormError(response, 'form', 'image', 'Изображение больше 40 мегапикселей')
+        self.assertFalse(Post.objects.exists())
+
+
+class TestMediaFiles(YatubeTestCase):
+    gif = TestImageStorage.gif
+
+    def setUp(self) -> None:
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.factory = RequestFactory()
+        with mock.patch('posts.tasks.get_thumbnail'):
+            self.post = Post.objects.create(
+                author=User.objects.create_user(username='Uploader'), text='Картинка',
+                image=SimpleUploadedFile('picture.gif', self.gif, 'image/gif'))
+        self.name = self.post.image.name
+
+    def get(self, **headers):
+        return serve_media(self.factory.get(f'/media/{self.name}', **headers), self.name)
+
+    def test_whole_file_and_ranges(self):
+        response = self.get()
+        self.assertEqual(b''.join(response.streaming_content), self.gif)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.gif[2:6])
+        self.assertEqual(response['Content-Range'], f'bytes 2-5/{len(self.gif)}')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), self.gif[-3:])
+        self.assertEqual(self.get(HTTP_RANGE='bytes=1000-').status_code, 416)
+        # Файл сменился после первого запроса: If-Range не совпал.
+        response = self.get(HTTP_RANGE='bytes=2-5',
+                            HTTP_IF_RANGE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_ACCEL='nginx')
+    def test_bytes_delegated_to_proxy(self):
+        response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/gif')
+
+    def test_access_checked(self):
+        with self.assertRaises(Http404):
+            serve_media(self.factory.get('/media/'), '../' + os.path.basename(__file__))
+        self.post.delete()
+        with self.assertRaises(Http404):
+            self.get()
+
+
+class TestFeedPagination(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.reader = User.objects.create_user(username='Reader')
+        self.client.force_login(self.reader)
+        for i in range(3):
+            Post.objects.create(author=self.author, text=f'Запись {i}')
+
+    def test_window_of_page_links(self):
+        paginator = Paginator(range(1000), 10)
+        self.assertEqual(page_window(paginator.page(50)), [1, None, 48, 49, 50, 51, 52, None, 100])
+        self.assertEqual(page_window(paginator.page(1)), [1, 2, 3, None, 100])
+        self.assertEqual(page_window(paginator.page(4)), [1, 2, 3, 4, 5, 6, None, 100])
+        self.assertEqual(page_window(Paginator(range(5), 10).page(1)), [1])
+
+    def test_feed_counts_cached_until_posts_change(self):
+        scope = f'author:{self.author.pk}'
+        self.assertEqual(tiered_posts(scope, author_id=self.author.pk).count(), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(tiered_posts(scope, author_id=self.author.pk).count(), 3)
+
+        Post.objects.create(author=self.author, text='Новая запись')
+        self.assertEqual(tiered_posts(scope, author_id=self.author.pk).count(), 4)
+        post = Post.objects.filter(author=self.author).first()
+        post.delete()
+        self.assertEqual(tiered_posts(scope, author_id=self.author.pk).count(), 3)
+
+    def test_follow_feed_count_follows_subscriptions(self):
+        url = reverse('follow_index')
+        self.assertEqual(self.client.get(url).context['paginator'].count, 0)
+        self.client.get(reverse('profile_follow', kwargs={'username': 'Author'}))
+        self.assertEqual(self.client.get(url).context['paginator'].count, 3)
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'Author'}))
+        self.assertEqual(self.client.get(url).context['paginator'].count, 0)
+
+
+@override_settings(EVENTS_HOLD_SECONDS=0.3)
+class TestNewPostEvents(YatubeTestCase):
+    def setUp(self) -> None:
+        self.since = time.time() - 60
+        self.author = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Группа', slug='group', description='-')
+        Post.objects.create(author=self.author, text='Первая', group=self.group)
+        Post.objects.create(author=self.author, text='Вторая')
+
+    def publish_later(self, channels, delay=0.05):
+        timer = threading.Timer(delay, bus.publish, [channels])
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_local_bus_wakes_waiters(self):
+        local = LocalBus()
+        known = local.versions_of(['all'])
+        timer = threading.Timer(0.05, local.publish, [['all', 'group:1']])
+        timer.start()
+        started = time.monotonic()
+        self.assertEqual(local.wait(['all'], known, 5), {'all': 1})
+        self.assertLess(time.monotonic() - started, 1)
+        timer.join()
+        self.assertEqual(local.wait(['all'], {'all': 1}, 0.01), {'all': 1})
+
+    @override_settings(EVENTS_POLL_INTERVAL=0.05)
+    def test_cache_bus_polls_once_per_process(self):
+        shared = CacheBus()
+        known = shared.versions_of(['all'])
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(
+            shared.wait(['all'], known, 5))) for _ in range(10)]
+        with mock.patch.object(CacheBus, 'versions_of', autospec=True,
+                               side_effect=CacheBus.versions_of) as versions_of:
+            for waiter in waiters:
+                waiter.start()
+            time.sleep(0.3)
+            # Запись из другого процесса видна только через кэш.
+            cache.incr(CacheBus.key('all')) if cache.get(CacheBus.key('all')) \
+                else cache.set(CacheBus.key('all'), 1, None)
+            for waiter in waiters:
+                waiter.join(5)
+        self.assertEqual(results, [{'all': known['all'] + 1}] * 10)
+        # Один опрос кэша на интервал, а не на каждого ожидающего.
+        self.assertLess(versions_of.call_count, 20)
+
+    @override_settings(EVENTS_MAX_STREAMS=0)
+    def test_busy_process_answers_at_once(self):
+        started = time.monotonic()
+        response = self.client.get(reverse('new_posts_events'), {'since': self.since})
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn(f'retry: {EVENTS_BUSY_RETRY}', body)
+        self.assertIn('data: {"new": 2}', body)
+        response = self.client.get(reverse('new_posts_poll'), {'since': self.since, 'seen': 2})
+        self.assertEqual(json.loads(response.content), {'new': 2, 'retry': EVENTS_BUSY_RETRY})
+        self.assertLess(time.monotonic() - started, 0.25)
+
+    def test_event_stream_counts_new_posts(self):
+        self.publish_later(['all'])
+        response = self.client.get(reverse('new_posts_events'), {'since': self.since})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertEqual(body.count('event: posts'), 1)
+        self.assertIn('data: {"new": 2}', body)
+
+        response = self.client.get(reverse('new_posts_events'),
+                                   {'since': self.since, 'feed': 'group', 'group': 'group'})
+        self.assertIn('data: {"new": 1}', b''.join(response.streaming_content).decode())
+
+    def test_inactive_authors_not_counted(self):
+        spammer = User.objects.create_user(username='Spammer')
+        Post.objects.create(author=spammer, text='Спам')
+        with override_settings(JOBS_EAGER=False):
+            deactivate_user(spammer)
+        with mock.patch('posts.views.release_connections') as release_connections:
+            response = self.client.get(reverse('new_posts_events'), {'since': self.since})
+            self.assertIn('data: {"new": 2}', b''.join(response.streaming_content).decode())
+        release_connections.assert_called()
+
+    def test_long_poll(self):
+        url = reverse('new_posts_poll')
+        response = self.client.get(url, {'since': self.since, 'seen': 0})
+        self.assertEqual(json.loads(response.content), {'new': 2})
+
+        self.publish_later(['all'])
+        started = time.monotonic()
+        response = self.client.get(url, {'since': self.since, 'seen': 2})
+        self.assertEqual(json.loads(response.content), {'new': 2})
+        self.assertLess(time.monotonic() - started, 0.25)
+
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=self.author)
+        self.client.force_login(reader)
+        response = self.client.get(url, {'since': self.since, 'feed': 'follow'})
+        self.assertEqual(json.loads(response.content), {'new': 2})
+        self.assertEqual(self.client.get(url, {'since': 'x'}).status_code, 400)
+
+    def test_new_post_published_after_commit(self):
+        known = bus.versions_of(['all', f'group:{self.group.pk}'])
+        Post.objects.create(author=self.author, text='Третья', group=self.group)
+        self.assertEqual(bus.versions_of(['all', f'group:{self.group.pk}']),
+                         {channel: version + 1 for channel, version in known.items()})
+
+
+class TestGroupLookup(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.client.force_login(self.user)
+        for number in range(30):
+            Group.objects.create(title=f'Группа {number}', slug=f'group-{number}',
+                                 description='-')
+        self.group = Group.objects.create(title='Кошки', slug='cats', description='-')
+
+    def test_lookup_by_prefix(self):
+        response = self.client.get(reverse('group_lookup'), {'q': ' коШ'})
+        self.assertEqual(json.loads(response.content),
+                         {'results': [{'id': self.group.pk, 'title': 'Кошки'}]})
+        response = self.client.get(reverse('group_lookup'), {'q': 'группа 1'})
+        self.assertEqual(len(json.loads(response.content)['results']), 10)
+        response = self.client.get(reverse('group_lookup'), {'q': ''})
+        self.assertEqual(json.loads(response.content), {'results': []})
+
+        self.group.title = 'Собаки'
+        self.group.save(update_fields=['title'])
+        self.assertEqual(list(Group.lookup('соб', 10)), [{'id': self.group.pk, 'title': 'Собаки'}])
+
+    def test_form_does_not_list_groups(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('new_post'))
+        self.assertFalse([query for query in queries
+                          if 'posts_group' in query['sql'] and 'LIMIT' not in query['sql']])
+        self.assertNotContains(response, 'Группа 1')
+        self.assertContains(response, reverse('group_lookup'))
+
+        response = self.client.post(reverse('new_post'),
+                                    {'text': 'Про кошек', 'group': self.group.pk}, follow=True)
+        post = Post.objects.get(author=self.user)
+        self.assertEqual(post.group, self.group)
+        response = self.client.get(reverse('post_edit', args=[self.user.username, post.pk]))
+        self.assertContains(response, 'value="Кошки"')
+        response = self.client.post(reverse('new_post'), {'text': 'Без группы', 'group': 'x'})
+        self.assertTrue(response.context['form'].errors['group'])
+
+
+class TestServeWarmUp(YatubeTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        Post.objects.create(author=self.author, text='Прогретая запись')
+        # С выключенным DEBUG Django сам включает кэширующий загрузчик, а тест
+        # задаёт его явно, как и адрес сайта.
+        templates = [dict(settings.TEMPLATES[0], APP_DIRS=False)]
+        templates[0]['OPTIONS'] = dict(templates[0]['OPTIONS'], loaders=[
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ])
+        cached_templates = override_settings(TEMPLATES=templates,
+                                             SITE_URL='http://localhost:8000')
+        cached_templates.enable()
+        self.addCleanup(cached_templates.disable)
+        # Как test.Client: запросы прогрева не должны закрывать соединение теста.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def test_check_warms_templates_and_pages(self):
+        out = StringIO()
+        call_command('serve', '--check', stdout=out)
+        self.assertIn('Прогрето шаблонов', out.getvalue())
+        self.assertIn('Прогрето страниц: 4', out.getvalue())
+        self.assertIn('Приложение готово', out.getvalue())
+
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIn('index.html', loader.get_template_cache)
+        self.assertIn('posts/widgets/group_autocomplete.html', loader.get_template_cache)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'), HTTP_HOST='localhost:8000')
+        self.assertContains(response, 'Прогретая запись')
+
+    def test_pool_caps_threads_and_drains(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def application(environ, start_response):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.2)
+            with lock:
+                running.pop()
+            start_response('200 OK', [('Content-Length', '2')])
+            return [b'ok']
+
+        server = PooledWSGIServer(('127.0.0.1', 0), RequestHandler, threads=2)
+        server.set_app(application)
+        logging = mock.patch.object(RequestHandler, 'log_message')
+        logging.start()
+        self.addCleanup(logging.stop)
+        serving = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        serving.start()
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+        bodies = []
+        clients = [threading.Thread(target=lambda: bodies.append(urlopen(url, timeout=5).read()))
+                   for _ in range(5)]
+        for client in clients:
+            client.start()
+        time.sleep(0.1)
+        # Остановка дожидается и начатых, и ждущих в очереди запросов.
+        server.shutdown()
+        serving.join(5)
+        self.assertEqual(server.drain(5), 0)
+        for client in clients:
+            client.join(5)
+        server.server_close()
+        self.assertEqual(bodies, [b'ok'] * 5)
+        self.assertEqual(max(peak), 2)
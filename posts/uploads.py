@@ -0,0 +1,58 @@
+"""
+Загрузка изображений с ограниченной памятью.
+
+Обработчик пишет файл во временный файл кусками по 64 КБ и по пути
+считает sha256, так что хранилище (posts.storage) переносит файл на место
+без повторного чтения. Файл больше MAX_IMAGE_UPLOAD_SIZE дальше лимита
+не пишется, а у картинки читается только заголовок: слишком большое
+число пикселей (бомба распаковки) отклоняется до декодирования.
+Ошибка сохраняется в upload_error файла и показывается формой.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+
+def image_header_error(file):
+    """
+    Проверяет размеры картинки по заголовку, не декодируя её.
+    """
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        width = height = None
+    except Exception:
+        # Не картинка - это скажет ImageField формы.
+        return None
+    finally:
+        file.seek(0)
+    if width is None or width * height > settings.MAX_IMAGE_PIXELS:
+        return f'Изображение больше {settings.MAX_IMAGE_PIXELS // 1000000} мегапикселей'
+    return None
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        # Остаток слишком большого файла дочитывается из запроса, но не пишется.
+        if self.received <= settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.digest.update(raw_data)
+            self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file_size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            file.upload_error = f'Файл больше {filesizeformat(settings.MAX_IMAGE_UPLOAD_SIZE)}'
+        else:
+            file.upload_error = image_header_error(file)
+            file.content_digest = self.digest.hexdigest()
+        return file
@@ -5,10 +5,20 @@ from posts import views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('trending/', views.trending, name='trending'),
+    path('groups/', views.group_index, name='group_index'),
+    path('groups/lookup/', views.group_lookup, name='group_lookup'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
+    path('group/<slug:slug>/archive/<int:year>/<int:month>/', views.group_posts,
+         name='group_archive'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('follow/bulk/', views.follow_bulk, name='follow_bulk'),
+    path('events/', views.new_posts_events, name='new_posts_events'),
+    path('events/poll/', views.new_posts_poll, name='new_posts_poll'),
     path('<str:username>/', views.profile, name='profile'),
+    path('<str:username>/archive/<int:year>/<int:month>/', views.profile,
+         name='profile_archive'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
     path('<str:username>/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('<str:username>/<int:post_id>/comment', views.add_comment, name='add_comment'),
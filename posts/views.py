@@ -1,15 +1,41 @@
+import json
+import time
+from datetime import date, datetime
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
 from django.views.decorators.cache import cache_page
 
-from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post, User
+from yatube.ratelimit import rate_limit
+
+from .archival import TieredPosts, tiered_posts
+from .events import EVENTS_BUSY_RETRY, EVENTS_KEEPALIVE, EVENTS_RETRY, bus, streams
+from .forms import CommentForm, FollowImportForm, PostForm
+from .models import (ArchiveMonth, ArchivedPost, Comment, Follow, Group, Post, Recommendation,
+                     User)
+
+
+RECOMMENDATIONS_SHOWN = 5
+GROUP_LOOKUP_LIMIT = 10
+
+
+def recommended_authors(user):
+    if not user.is_authenticated:
+        return Recommendation.objects.none()
+    return (Recommendation.objects.filter(user=user, author__is_active=True)
+            .select_related('author')[:RECOMMENDATIONS_SHOWN])
 
 
 @cache_page(20, key_prefix='index_page')
 def index(request):
-    post_list = Post.objects.all()
+    post_list = tiered_posts()
     paginator = Paginator(post_list, 10)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
@@ -23,9 +49,72 @@ def index(request):
     )
 
 
-def group_posts(request, slug):
+@cache_page(20, key_prefix='trending_page')
+def trending(request):
+    post_list = (Post.objects.filter(trending__isnull=False)
+                 .annotate(score=F('trending__score'))
+                 .order_by('-score', '-pub_date')
+                 .for_list())
+    paginator = Paginator(post_list, 10)
+    page_number = request.GET.get('page')
+    page = paginator.get_page(page_number)
+    return render(
+        request,
+        'trending.html',
+        {
+            'page': page,
+            'paginator': paginator
+        }
+    )
+
+
+def group_index(request):
+    groups = Group.objects.order_by('title').only(
+        'title', 'slug', 'post_count', 'last_post_date', 'last_post_title')
+    paginator = Paginator(groups, 50)
+    page_number = request.GET.get('page')
+    page = paginator.get_page(page_number)
+    return render(
+        request,
+        'groups.html',
+        {
+            'page': page,
+            'paginator': paginator
+        }
+    )
+
+
+@cache_page(60, key_prefix='group_lookup')
+def group_lookup(request):
+    """
+    Сообщества для подсказок в форме записи: по префиксу названия q.
+    """
+    prefix = request.GET.get('q', '').strip()
+    results = list(Group.lookup(prefix, GROUP_LOOKUP_LIMIT)) if prefix else []
+    return JsonResponse({'results': results})
+
+
+def month_filter(year, month):
+    """
+    Условие на pub_date для месяца: диапазон, который идёт по индексу.
+    """
+    try:
+        start = date(year, month, 1)
+        end = date(year + month // 12, month % 12 + 1, 1)
+    except ValueError:
+        raise Http404
+    return {
+        'pub_date__gte': timezone.make_aware(datetime.combine(start, datetime.min.time())),
+        'pub_date__lt': timezone.make_aware(datetime.combine(end, datetime.min.time())),
+    }
+
+
+def group_posts(request, slug, year=None, month=None):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    lookups = {'group_id': group.pk}
+    if year is not None:
+        lookups.update(month_filter(year, month))
+    posts = tiered_posts(f'group:{group.pk}', **lookups)
     paginator = Paginator(posts, 10)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
@@ -35,12 +124,15 @@ def group_posts(request, slug):
         {
             'group': group,
             'page': page,
-            'paginator': paginator
+            'paginator': paginator,
+            'archive_months': ArchiveMonth.for_group(group),
+            'archive_month': year and date(year, month, 1),
         }
     )
 
 
 @login_required
+@rate_limit('new_post', user='5/m', ip='30/m')
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
@@ -57,9 +149,12 @@ def new_post(request):
     )
 
 
-def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
+def profile(request, username, year=None, month=None):
+    author = get_object_or_404(User, username=username, is_active=True)
+    lookups = {'author_id': author.pk}
+    if year is not None:
+        lookups.update(month_filter(year, month))
+    posts = tiered_posts(f'author:{author.pk}', **lookups)
     paginator = Paginator(posts, 6)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
@@ -74,12 +169,29 @@ def profile(request, username):
             'paginator': paginator,
             'following': following,
             'profile': True,
+            'recommendations': recommended_authors(request.user),
+            'archive_months': ArchiveMonth.for_author(author),
+            'archive_month': year and date(year, month, 1),
         }
         )
 
 
+def get_author_post(username, post_id, archived=False):
+    """
+    Запись ищется в шарде автора, поэтому сначала находим автора.
+    При archived=True ищем и в архиве: архивные записи только читаются.
+    """
+    author = get_object_or_404(User, username=username, is_active=True)
+    post = author.posts.filter(pk=post_id).first()
+    if post is None and archived:
+        post = author.archived_posts.filter(pk=post_id).first()
+    if post is None:
+        raise Http404
+    return post
+
+
 def post_view(request, username, post_id):
-    selected_post = get_object_or_404(Post, pk=post_id, author__username=username)
+    selected_post = get_author_post(username, post_id, archived=True)
     author = selected_post.author
     form = CommentForm()
     return render(
@@ -94,7 +206,7 @@ def post_view(request, username, post_id):
 
 
 def post_edit(request, username, post_id):
-    get_post = get_object_or_404(Post, pk=post_id, author__username=username)
+    get_post = get_author_post(username, post_id)
     if request.user != get_post.author:
         return redirect('post_view', username=username, post_id=post_id)
     form = PostForm(request.POST or None, files=request.FILES or None, instance=get_post)
@@ -113,8 +225,9 @@ def post_edit(request, username, post_id):
 
 
 @login_required
+@rate_limit('add_comment', user='10/m', ip='60/m')
 def add_comment(request, username, post_id):
-    get_post = get_object_or_404(Post, pk=post_id, author__username=username)
+    get_post = get_author_post(username, post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -134,7 +247,9 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
+    post_list = TieredPosts(Post.objects.followed_by(request.user).for_list(),
+                            ArchivedPost.objects.followed_by(request.user).for_list(),
+                            ('all', f'follower:{request.user.pk}'))
     paginator = Paginator(post_list, 10)
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
@@ -143,31 +258,144 @@ def follow_index(request):
         'follow.html',
         {
             'page': page,
-            'paginator': paginator
+            'paginator': paginator,
+            'recommendations': recommended_authors(request.user),
         }
     )
 
 
 @login_required
+@rate_limit('follow', user='30/m', ip='120/m', methods=('GET', 'POST'))
 def profile_follow(request, username):
-    follower = request.user
-    following = get_object_or_404(User, username=username)
-    follow = Follow.objects.filter(user=follower, author=following).exists()
-    if not follow and follower != following:
-        Follow.objects.create(user=follower, author=following)
+    following = get_object_or_404(User, username=username, is_active=True)
+    Follow.objects.follow(request.user, following)
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    follower = request.user
     following = get_object_or_404(User, username=username)
-    follow = Follow.objects.filter(user=follower, author=following)
-    if follow.exists() and follower != following:
-        follow.delete()
+    Follow.objects.unfollow(request.user, following)
     return redirect('profile', username=username)
 
 
+@login_required
+def follow_bulk(request):
+    if request.method == 'POST':
+        form = FollowImportForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        Follow.objects.bulk_follow(request.user, form.cleaned_data['authors'])
+        return redirect('follow_index')
+    usernames = Follow.objects.export(request.user)
+    return HttpResponse(
+        ''.join(f'{username}\n' for username in usernames.iterator()),
+        content_type='text/plain; charset=utf-8'
+    )
+
+
+def new_posts_feed(request):
+    """
+    Каналы и выборка записей новее since для ленты из параметров:
+    feed=all, feed=group&group=<slug> или feed=follow.
+    """
+    try:
+        since = datetime.fromtimestamp(float(request.GET['since']), timezone.utc)
+    except (KeyError, ValueError, OverflowError, OSError):
+        return None, None
+    feed = request.GET.get('feed', 'all')
+    if feed == 'group':
+        group = get_object_or_404(Group, slug=request.GET.get('group', ''))
+        channels, posts = [f'group:{group.pk}'], Post.objects.filter(group_id=group.pk)
+    elif feed == 'follow' and request.user.is_authenticated:
+        author_ids = list(request.user.follower.values_list('author_id', flat=True))
+        channels = [f'author:{author_id}' for author_id in author_ids]
+        posts = Post.objects.filter(author_id__in=author_ids)
+    else:
+        channels, posts = ['all'], Post.objects.all()
+    return channels, posts.filter(pub_date__gt=since).by_active_authors()
+
+
+def release_connections():
+    """
+    Закрывает соединения с базой, пока долгий ответ ждёт публикации.
+    Соединения в открытой транзакции (тесты) остаются как есть.
+    """
+    if not any(conn.in_atomic_block for conn in connections.all()):
+        close_old_connections()
+
+
+def new_posts_events(request):
+    """
+    Поток Server-Sent Events с числом новых записей ленты. База
+    опрашивается только после публикации в каналах ленты.
+    """
+    channels, new_posts = new_posts_feed(request)
+    if channels is None:
+        return HttpResponseBadRequest('since')
+
+    def stream():
+        if not streams.acquire():
+            # Все места заняты: текущее число и переподключение попозже.
+            yield f'retry: {EVENTS_BUSY_RETRY}\n\n'
+            yield f'event: posts\ndata: {json.dumps({"new": new_posts.count()})}\n\n'
+            return
+        try:
+            yield f'retry: {EVENTS_RETRY}\n\n'
+            deadline = time.monotonic() + settings.EVENTS_HOLD_SECONDS
+            versions, shown = bus.versions_of(channels), None
+            while True:
+                count = new_posts.count()
+                if count != shown:
+                    shown = count
+                    yield f'event: posts\ndata: {json.dumps({"new": count})}\n\n'
+                release_connections()
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    current = bus.wait(channels, versions, min(remaining, EVENTS_KEEPALIVE))
+                    if current != versions:
+                        versions = current
+                        break
+                    yield ': keepalive\n\n'
+        finally:
+            streams.release()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Иначе nginx копит поток в буфере.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def new_posts_poll(request):
+    """
+    Долгий опрос для браузеров без EventSource: отвечает сразу, если
+    новых записей не столько, сколько seen, иначе ждёт публикации.
+    """
+    channels, new_posts = new_posts_feed(request)
+    try:
+        seen = int(request.GET.get('seen', 0))
+    except ValueError:
+        channels = None
+    if channels is None:
+        return HttpResponseBadRequest('since, seen')
+    count = new_posts.count()
+    if count != seen:
+        return JsonResponse({'new': count})
+    if not streams.acquire():
+        return JsonResponse({'new': count, 'retry': EVENTS_BUSY_RETRY})
+    try:
+        versions = bus.versions_of(channels)
+        release_connections()
+        if bus.wait(channels, versions, settings.EVENTS_HOLD_SECONDS) != versions:
+            count = new_posts.count()
+    finally:
+        streams.release()
+    return JsonResponse({'new': count})
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -1,3 +1,33 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-# Register your models here.
+from posts.moderation import deactivate_user
+
+User = get_user_model()
+
+
+class UserAdmin(BaseUserAdmin):
+    actions = ('delete_in_background',)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Стандартное удаление собирает в памяти все записи пользователя.
+        actions.pop('delete_selected', None)
+        return actions
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def delete_in_background(self, request, queryset):
+        users = list(queryset.only('pk', 'username'))
+        for user in users:
+            deactivate_user(user)
+        self.message_user(request, f'Скрыто пользователей: {len(users)}, '
+                                   f'данные удаляются в фоне', messages.SUCCESS)
+
+    delete_in_background.short_description = 'Удалить в фоне со всеми записями'
+
+
+admin.site.unregister(User)
+admin.site.register(User, UserAdmin)
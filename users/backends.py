@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+# Хэш пароля в общий кэш не попадает: вместо него хранится хэш сессии,
+# которым AuthenticationMiddleware проверяет, не сменился ли пароль.
+SESSION_HASH_FIELD = 'session_auth_hash'
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def cached_fields(user):
+    fields = {field.attname: getattr(user, field.attname)
+              for field in user._meta.concrete_fields if field.attname != 'password'}
+    fields[SESSION_HASH_FIELD] = user.get_session_auth_hash()
+    return fields
+
+
+def user_from_cache(fields):
+    """
+    Пользователь из кэша с отложенным полем password: обращение к паролю
+    (и save() с ним) перечитывает его из базы, а не затирает.
+    """
+    model = get_user_model()
+    fields = dict(fields)
+    session_auth_hash = fields.pop(SESSION_HASH_FIELD)
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in fields]
+    user = model.from_db('default', names, [fields[name] for name in names])
+
+    def get_session_auth_hash():
+        # После set_password (или чтения пароля из базы) хэш считается
+        # по настоящему паролю, иначе update_session_auth_hash сохранил бы
+        # в сессию устаревший хэш и разлогинил пользователя.
+        if 'password' in user.__dict__:
+            return model.get_session_auth_hash(user)
+        return session_auth_hash
+
+    user.get_session_auth_hash = get_session_auth_hash
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который берёт пользователя сессии из общего кэша, а не
+    из базы на каждом запросе. Кэш сбрасывается при сохранении и
+    удалении пользователя (users.signals).
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        fields = cache.get(key)
+        if fields is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, cached_fields(user), settings.USER_CACHE_TIMEOUT)
+        else:
+            user = user_from_cache(fields)
+        return user if self.user_can_authenticate(user) else None
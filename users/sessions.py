@@ -0,0 +1,53 @@
+"""
+Сессии в общем кэше с отложенной записью в базу.
+
+Чтение идёт из кэша, база нужна только при промахе. Новая сессия сразу
+пишется в базу. Изменения существующей при общем кэше (redis, memcached)
+пишутся в кэш, а в базу - задачей persist_session не чаще раза в
+SESSION_WRITE_BEHIND_DELAY секунд: повторные изменения за это время
+базу не трогают. Задача берёт последнее содержимое из кэша, а если его
+там уже нет - данные, переданные при постановке. С кэшем в памяти
+процесса воркер run_jobs сессий не видит, поэтому изменения сразу
+пишутся в базу, как в cached_db.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from jobs.queue import enqueue
+
+from .tasks import persist_session
+
+
+class SessionStore(CachedDBStore):
+    def write_behind(self):
+        return not isinstance(self._cache, (LocMemCache, DummyCache))
+
+    def pending_key(self):
+        return f'{self.cache_key}:pending'
+
+    def save(self, must_create=False):
+        if must_create or self.session_key is None or not self.write_behind():
+            return super().save(must_create=must_create)
+        data = self._get_session()
+        self._cache.set(self.cache_key, data, self.get_expiry_age())
+        delay = settings.SESSION_WRITE_BEHIND_DELAY
+        if self._cache.add(self.pending_key(), True, delay):
+            enqueue(persist_session, delay=delay,
+                    session_key=self.session_key, session_data=self.encode(data))
+
+    def persist(self, session_data):
+        """
+        Записывает сессию в базу. Строку удалённой сессии (выход,
+        смена ключа) задача не восстанавливает.
+        """
+        self._cache.delete(self.pending_key())
+        data = self._cache.get(self.cache_key)
+        self._session_cache = self.decode(session_data) if data is None else data
+        try:
+            db.SessionStore.save(self)
+        except UpdateError:
+            pass
@@ -0,0 +1,12 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import tasks  # noqa: регистрирует задачи для воркера run_jobs
+from .backends import forget_user
+
+
+@receiver((post_save, post_delete), sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    # Смена пароля, блокировка, last_login при входе - всё через save().
+    forget_user(instance.pk)
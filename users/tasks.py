@@ -0,0 +1,8 @@
+from jobs.queue import task
+
+
+@task
+def persist_session(session_key, session_data):
+    from .sessions import SessionStore
+
+    SessionStore(session_key).persist(session_data)
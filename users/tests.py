@@ -1,3 +1,141 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import run_pending
+from posts.moderation import deactivate_user
+from users.backends import CachedModelBackend, user_cache_key
+from users.sessions import SessionStore
+from yatube.testing import ImmediateOnCommit
+
+User = get_user_model()
+
+
+class TestCachedAuth(TestCase):
+    # deactivate_user читает записи пользователя в его шарде.
+    databases = '__all__'
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username='TestUser', password='password')
+        self.client.login(username='TestUser', password='password')
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries
+                if 'auth_user' in query['sql'] or 'django_session' in query['sql']]
+
+    def test_page_view_without_auth_queries(self):
+        self.auth_queries('/new/')
+        self.assertEqual(self.auth_queries('/new/'), [])
+
+    def test_user_changes_invalidate_cache(self):
+        self.auth_queries('/new/')
+        self.user.set_password('new-password')
+        self.user.save()
+        # Смена пароля разлогинивает старые сессии.
+        response = self.client.get('/new/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_change_keeps_session(self):
+        self.auth_queries('/new/')
+        response = self.client.post(reverse('password_change'), {
+            'old_password': 'password',
+            'new_password1': 'Ne3w-pass-word',
+            'new_password2': 'Ne3w-pass-word',
+        })
+        self.assertRedirects(response, reverse('password_change_done'))
+        self.auth_queries('/new/')
+        self.assertNotEqual(cache.get(user_cache_key(self.user.pk))['session_auth_hash'],
+                            self.user.get_session_auth_hash())
+
+    def test_deactivated_user_logged_out(self):
+        self.auth_queries('/new/')
+        deactivate_user(self.user)
+        self.assertEqual(self.client.get('/new/').status_code, 302)
+
+    def test_password_hash_not_cached(self):
+        self.auth_queries('/new/')
+        fields = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', fields)
+        self.assertNotIn(self.user.password, fields.values())
+
+        cached = CachedModelBackend().get_user(self.user.pk)
+        cached.first_name = 'Имя'
+        cached.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('password'))
+
+
+@override_settings(JOBS_EAGER=False)
+class TestWriteBehindSession(ImmediateOnCommit, TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        patcher = mock.patch.object(SessionStore, 'write_behind', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_update_persisted_by_job(self):
+        session = SessionStore()
+        session['value'] = 1
+        session.create()
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded(),
+                         {'value': 1})
+
+        session['value'] = 2
+        session.save()
+        self.assertEqual(SessionStore(session.session_key)['value'], 2)
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded(),
+                         {'value': 1})
+        self.assertEqual(Job.objects.count(), 1)
+
+        # Повторные изменения до выполнения задачи базу не трогают.
+        session['value'] = 3
+        with self.assertNumQueries(0):
+            session.save()
+        self.run_due_jobs()
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded(),
+                         {'value': 3})
+
+    def run_due_jobs(self):
+        Job.objects.update(run_at=timezone.now())
+        run_pending()
+
+    def test_job_carries_data_for_other_process(self):
+        session = SessionStore()
+        session.create()
+        session['_auth_user_id'] = '1'
+        session.save()
+        # Воркер с другим (пустым) кэшем пишет данные из задачи.
+        cache.clear()
+        self.run_due_jobs()
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded(),
+                         {'_auth_user_id': '1'})
+
+    def test_deleted_session_not_restored(self):
+        session = SessionStore()
+        session.create()
+        session['value'] = 1
+        session.save()
+        session.delete()
+        self.run_due_jobs()
+        self.assertFalse(Session.objects.filter(pk=session.session_key).exists())
+
+    def test_local_cache_saves_at_once(self):
+        session = SessionStore()
+        session.create()
+        session['value'] = 1
+        with mock.patch.object(SessionStore, 'write_behind', return_value=False):
+            session.save()
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded(),
+                         {'value': 1})
+        self.assertFalse(Job.objects.exists())
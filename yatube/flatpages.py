@@ -0,0 +1,105 @@
+"""
+Flatpages из памяти процесса.
+
+Страница, её шаблон и (для анонимных посетителей) готовый HTML хранятся
+в словаре процесса, поэтому повторные запросы обходятся без базы.
+Сохранение или удаление FlatPage увеличивает счётчик поколения в общем
+кэше, и каждый процесс при следующем запросе сбрасывает свой словарь.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.flatpages.views import DEFAULT_TEMPLATE
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect
+from django.template import loader
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from django.utils.safestring import mark_safe
+from django.views.decorators.csrf import csrf_protect
+
+GENERATION_KEY = 'flatpages_generation'
+# Страницы перечитываются не реже раза в час, даже без сигналов.
+FLATPAGE_MAX_AGE = 60 * 60
+# Защита от роста словаря при переборе несуществующих адресов.
+FLATPAGE_CACHE_SIZE = 1000
+
+_pages = {}
+_generation = None
+
+
+class CachedFlatPage:
+    def __init__(self, flatpage):
+        self.flatpage = flatpage
+        self.loaded = time.monotonic()
+        self.anonymous_content = None
+        self.template = None
+        if flatpage is not None:
+            flatpage.title = mark_safe(flatpage.title)
+            flatpage.content = mark_safe(flatpage.content)
+            if flatpage.template_name:
+                self.template = loader.select_template((flatpage.template_name, DEFAULT_TEMPLATE))
+            else:
+                self.template = loader.get_template(DEFAULT_TEMPLATE)
+
+    def expired(self):
+        return time.monotonic() - self.loaded > FLATPAGE_MAX_AGE
+
+
+@receiver((post_save, post_delete), sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def flatpages_changed(sender, **kwargs):
+    cache.set(GENERATION_KEY, cache.get(GENERATION_KEY, 0) + 1, None)
+    _pages.clear()
+
+
+def get_cached_flatpage(site_id, url):
+    global _generation
+    generation = cache.get(GENERATION_KEY, 0)
+    if generation != _generation or len(_pages) >= FLATPAGE_CACHE_SIZE:
+        _pages.clear()
+        _generation = generation
+    entry = _pages.get((site_id, url))
+    if entry is None or entry.expired():
+        entry = CachedFlatPage(FlatPage.objects.filter(url=url, sites=site_id).first())
+        _pages[site_id, url] = entry
+    return entry
+
+
+def flatpage(request, url):
+    """
+    Замена django.contrib.flatpages.views.flatpage с тем же поведением.
+    """
+    if not url.startswith('/'):
+        url = '/' + url
+    site_id = get_current_site(request).id
+    entry = get_cached_flatpage(site_id, url)
+    if entry.flatpage is None:
+        if (not url.endswith('/') and settings.APPEND_SLASH
+                and get_cached_flatpage(site_id, url + '/').flatpage is not None):
+            return HttpResponsePermanentRedirect(f'{request.path}/')
+        raise Http404
+    return render_flatpage(request, entry)
+
+
+@csrf_protect
+def render_flatpage(request, entry):
+    anonymous = not request.user.is_authenticated
+    if entry.flatpage.registration_required and anonymous:
+        return redirect_to_login(request.path)
+    # В шапке - имя пользователя, поэтому готовый HTML только для анонимных.
+    content = entry.anonymous_content if anonymous else None
+    if content is None:
+        content = entry.template.render({'flatpage': entry.flatpage}, request).encode()
+        if anonymous and not request.META.get('CSRF_COOKIE_USED'):
+            entry.anonymous_content = content
+    response = HttpResponse(content)
+    response['ETag'] = quote_etag(hashlib.md5(content).hexdigest())
+    patch_vary_headers(response, ('Cookie',))
+    return get_conditional_response(request, etag=response['ETag'], response=response)
@@ -0,0 +1,136 @@
+"""
+Раздача загруженных файлов (MEDIA_ROOT) в продакшене.
+
+serve_media проверяет доступ к файлу, а сами байты по MEDIA_ACCEL
+отдаёт веб-сервер перед приложением: nginx - по X-Accel-Redirect во
+внутренний location MEDIA_ACCEL_PREFIX, Apache/lighttpd - по X-Sendfile.
+Без веб-сервера файл отдаёт FileResponse: целиком - через
+wsgi.file_wrapper (sendfile у gunicorn и uwsgi), запрошенный диапазон
+байт (Range) - ответом 206.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from posts.models import StoredImage
+from posts.storage import is_content_addressed
+from yatube.staticfiles import IMMUTABLE_CACHE_CONTROL, MUTABLE_CACHE_CONTROL
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """
+    Файл, из которого читается только length байт начиная с start.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (начало, конец включительно) для заголовка Range из одного диапазона.
+    None - заголовка нет или он не поддерживается (тогда отдаётся весь
+    файл), ValueError - диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError
+    return start, end
+
+
+def media_path(path):
+    """
+    Путь к файлу, который можно отдать: внутри MEDIA_ROOT, не скрытый,
+    не недокачанная загрузка и, для картинок по хэшу, нужный записям.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if (any(part.startswith('.') for part in path.split('/')) or path.endswith('.upload')
+            or not os.path.isfile(full_path)):
+        raise Http404
+    if (is_content_addressed(path)
+            and not StoredImage.objects.filter(name=path, refcount__gt=0).exists()):
+        raise Http404
+    return full_path
+
+
+def serve_media(request, path):
+    full_path = media_path(path)
+    stat = os.stat(full_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_ACCEL == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX + path)
+    elif settings.MEDIA_ACCEL == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = file_response(request, full_path, stat, content_type)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if is_content_addressed(path)
+                                 else MUTABLE_CACHE_CONTROL)
+    return response
+
+
+def file_response(request, full_path, stat, content_type):
+    size = stat.st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range с другой датой означает, что файл сменился: отдаём целиком.
+    if 'HTTP_RANGE' in request.META and if_range in (None, http_date(stat.st_mtime)):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(FileRange(open(full_path, 'rb'), start, length),
+                                status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,123 @@
+"""
+Ограничение частоты запросов на запись.
+
+У каждого пользователя и каждого IP на каждое действие своё ведро жетонов
+в общем кэше: rate='10/m' - не больше десяти жетонов, ведро восполняется
+равномерно, по жетону раз в шесть секунд. В ведре хранятся число жетонов и
+время последнего восполнения, поэтому на границе минуты лимит не
+удваивается. Ведро меняется под коротким замком в кэше (cache.add), так
+что несколько процессов не выдадут лишних жетонов, а к базе проверка не
+обращается.
+"""
+import ipaddress
+import math
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+# Сколько раз с паузой в миллисекунду пробовать взять замок ведра.
+LOCK_ATTEMPTS = 50
+
+
+def parse_rate(rate):
+    """
+    '10/m' -> (10, 60): размер ведра и время его полного восполнения в секундах.
+    """
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period]
+
+
+def is_trusted_proxy(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in settings.TRUSTED_PROXIES)
+
+
+def client_ip(request):
+    """
+    Адрес клиента. Если запрос пришёл от доверенного прокси (TRUSTED_PROXIES),
+    адрес берётся из X-Forwarded-For: последний, добавленный не доверенным
+    прокси. Адреса левее него клиент мог подставить сам.
+    """
+    address = request.META.get('REMOTE_ADDR') or 'unknown'
+    if not is_trusted_proxy(address):
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+    for hop in reversed([hop.strip() for hop in forwarded if hop.strip()]):
+        address = hop
+        if not is_trusted_proxy(hop):
+            break
+    return address
+
+
+@contextmanager
+def bucket_lock(key):
+    lock_key = f'{key}:lock'
+    locked = False
+    for _ in range(LOCK_ATTEMPTS):
+        locked = cache.add(lock_key, True, 1)
+        if locked:
+            break
+        time.sleep(0.001)
+    try:
+        # Замок держит упавший процесс: через секунду он истечёт сам.
+        yield
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def take_token(scope, ident, rate):
+    """
+    Берёт жетон из ведра. Возвращает 0, если жетон был, иначе - через
+    сколько секунд в ведре появится жетон.
+    """
+    capacity, period = parse_rate(rate)
+    key = f'ratelimit:{scope}:{ident}'
+    with bucket_lock(key):
+        now = time.time()
+        # За period секунд ведро восполняется полностью, поэтому истёкший
+        # ключ - это полное ведро.
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * capacity / period)
+        if tokens >= 1:
+            cache.set(key, (tokens - 1, now), period)
+            return 0
+    return max(1, math.ceil((1 - tokens) * period / capacity))
+
+
+def rate_limit(scope, user=None, ip=None, methods=('POST',)):
+    """
+    Декоратор представления: не больше user запросов от пользователя и
+    ip запросов с одного адреса, например @rate_limit('comment', '10/m', '60/m').
+    Сверх лимита - ответ 429 с заголовком Retry-After.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if settings.RATE_LIMITS_ENABLED and request.method in methods:
+                retry_after = 0
+                if user and request.user.is_authenticated:
+                    retry_after = take_token(scope, f'user:{request.user.pk}', user)
+                # Отклонённый по лимиту пользователя запрос не тратит жетоны его IP.
+                if ip and not retry_after:
+                    retry_after = take_token(scope, f'ip:{client_ip(request)}', ip)
+                if retry_after:
+                    return too_many_requests(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def too_many_requests(request, retry_after):
+    response = render(request, 'misc/429.html', {'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
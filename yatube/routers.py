@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from posts.shards import is_sharded, shard_for_instance, sharding_enabled
+
+_state = threading.local()
+
+
+def database_location(alias):
+    settings_dict = connections[alias].settings_dict
+    return tuple(settings_dict.get(key) for key in ('ENGINE', 'HOST', 'PORT', 'NAME'))
+
+
+def replica_databases():
+    """
+    Реплики, отличные от основной базы. У настоящей реплики обычно то же
+    имя базы, но другой сервер; в тестах реплики зеркалят основную базу
+    (TEST MIRROR), совпадают с ней целиком и читать с них отдельно нельзя.
+    """
+    primary = database_location('default')
+    return [alias for alias in settings.REPLICA_DATABASES
+            if database_location(alias) != primary]
+
+
+def reads_from_replica():
+    return getattr(_state, 'replica', False) and not getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    """
+    Чтение страниц из REPLICA_VIEWS уходит на случайную реплику,
+    всё остальное и любая запись - на основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if sharding_enabled() and is_sharded(model):
+            return None
+        if settings.REPLICA_DATABASES and reads_from_replica():
+            replicas = replica_databases()
+            if replicas:
+                return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+class ShardRouter:
+    """
+    Записи, комментарии и счёт популярности читаются и пишутся в шард
+    автора записи. Запросы без подсказки об объекте остаются за
+    ShardedQuerySet, который сам выбирает шард или опрашивает все.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def _shard(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None or not sharding_enabled():
+            return None
+        if is_sharded(model):
+            return shard_for_instance(instance)
+        if is_sharded(instance):
+            # Автор и сообщество записи из шарда лежат в основной базе.
+            return 'default'
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1) or is_sharded(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db != 'default' and db in settings.POST_SHARDS:
+            return f'{app_label}.{model_name}' in settings.SHARDED_MODELS
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Включает чтение с реплик для страниц из REPLICA_VIEWS. После любой
+    записи браузер на REPLICA_PIN_SECONDS читает только с основной базы,
+    чтобы после new_post на index сразу была видна новая запись.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica = False
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            if getattr(_state, 'wrote', False):
+                response.set_cookie(settings.REPLICA_PIN_COOKIE,
+                                    str(time.time() + settings.REPLICA_PIN_SECONDS),
+                                    max_age=settings.REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite='Lax')
+        finally:
+            _state.replica = False
+            _state.wrote = False
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _state.replica = (
+            request.method in ('GET', 'HEAD')
+            and request.resolver_match.url_name in settings.REPLICA_VIEWS
+            and not self.pinned(request)
+        )
+
+    @staticmethod
+    def pinned(request):
+        try:
+            until = float(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0))
+        except ValueError:
+            return False
+        return until > time.time()
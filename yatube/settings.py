@@ -52,6 +52,7 @@ ALLOWED_HOSTS = [
 INSTALLED_APPS = [
     'users',
     'posts',
+    'jobs',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -65,6 +66,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'yatube.routers.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +96,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+TEST_RUNNER = 'yatube.testing.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -102,6 +106,34 @@ DATABASES = {
     'default': env.db(),
 }
 
+# Реплики для чтения: REPLICA_DATABASE_URLS=url1,url2
+REPLICA_DATABASES = []
+for number, url in enumerate(env.list('REPLICA_DATABASE_URLS', default=[]), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = env.db_url_config(url)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASES.append(alias)
+
+# Шарды записей и комментариев: POST_SHARD_DATABASE_URLS=url1,url2.
+# Основная база всегда первый шард, без дополнительных шардов
+# шардирование выключено.
+POST_SHARDS = ['default']
+for number, url in enumerate(env.list('POST_SHARD_DATABASE_URLS', default=[]), start=1):
+    alias = f'shard_{number}'
+    DATABASES[alias] = env.db_url_config(url)
+    POST_SHARDS.append(alias)
+SHARDED_MODELS = ('posts.post', 'posts.comment', 'posts.trendingpost',
+                  'posts.archivedpost', 'posts.archivedcomment')
+
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter', 'yatube.routers.ShardRouter']
+
+# Страницы (имена url), которые можно читать с реплик
+REPLICA_VIEWS = ('index', 'group', 'group_archive', 'profile', 'profile_archive', 'post',
+                 'follow_index')
+# Сколько секунд после записи пользователь читает только с основной базы
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+REPLICA_PIN_COOKIE = 'primary_pin'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -141,9 +173,30 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# Статика с хэшем в имени и сжатыми копиями: библиотеки из static/ и статика
+# приложений собираются командой collectstatic в STATIC_COLLECT_ROOT.
+if env.bool('STATIC_PRECOMPRESS', default=False):
+    STATICFILES_DIRS = [(name, os.path.join(STATIC_ROOT, name))
+                        for name in ('bootstrap', 'jquery', 'popper.js')]
+    STATIC_ROOT = env('STATIC_COLLECT_ROOT', default=os.path.join(BASE_DIR, 'static_collected'))
+    STATICFILES_STORAGE = 'yatube.staticfiles.PrecompressedManifestStorage'
+# Отдавать статику самим Django (yatube.staticfiles.serve_static), если перед
+# приложением нет веб-сервера, который раздаёт STATIC_ROOT
+STATIC_SERVE = env.bool('STATIC_SERVE', default=False)
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Отдавать загруженные файлы через yatube.mediafiles.serve_media. Байты отдаёт
+# веб-сервер: MEDIA_ACCEL=nginx (X-Accel-Redirect во внутренний location
+# MEDIA_ACCEL_PREFIX) или sendfile (X-Sendfile), без него - само приложение.
+MEDIA_SERVE = env.bool('MEDIA_SERVE', default=False)
+MEDIA_ACCEL = env('MEDIA_ACCEL', default='')
+MEDIA_ACCEL_PREFIX = env('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
+# Загрузки пишутся на диск кусками, в памяти файл целиком не держится
+FILE_UPLOAD_HANDLERS = ['posts.uploads.BoundedImageUploadHandler']
+MAX_IMAGE_UPLOAD_SIZE = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40 * 1000 * 1000
 
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
@@ -152,11 +205,60 @@ LOGOUT_REDIRECT_URL = 'index'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Дайджест новых записей для подписчиков (python manage.py send_digests)
+SITE_URL = env('SITE_URL', default='http://localhost:8000')
+DIGEST_SUBJECT = 'Новые записи ваших авторов на Yatube'
+# Период первой рассылки, дальше каждая продолжает предыдущую
+DIGEST_PERIOD_HOURS = 24
+
+# Записи старше стольких дней команда archive_posts переносит в архивные таблицы
+ARCHIVE_AFTER_DAYS = env.int('ARCHIVE_AFTER_DAYS', default=730)
+
 # Индентификатор текущего сайта
 SITE_ID = 1
 
+# Общий кэш: CACHE_URL=rediscache://... или memcache://... В нём живут сессии
+# и пользователи, поэтому у нескольких процессов кэш должен быть общим.
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
 }
+
+# Пользователь сессии и сама сессия читаются из кэша, без запросов к базе
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+SESSION_ENGINE = 'users.sessions'
+# Изменения сессии при общем кэше попадают в базу не чаще раза в столько секунд
+SESSION_WRITE_BEHIND_DELAY = 30
+USER_CACHE_TIMEOUT = 600
+
+# Лимиты на публикацию, комментарии и подписки (yatube.ratelimit)
+RATE_LIMITS_ENABLED = env.bool('RATE_LIMITS_ENABLED', default=True)
+# Адреса или сети прокси перед приложением (nginx): от них адрес клиента
+# берётся из X-Forwarded-For, иначе у всех клиентов был бы адрес прокси
+TRUSTED_PROXIES = env.list('TRUSTED_PROXIES', default=['127.0.0.1', '::1'])
+
+# Уведомления о новых записях (posts.events). Под WSGI открытый поток событий
+# или долгий опрос занимает поток сервера на EVENTS_HOLD_SECONDS, поэтому процесс
+# держит не больше EVENTS_MAX_STREAMS таких запросов, а остальным отвечает сразу
+# и просит прийти позже. Должно быть меньше SERVE_THREADS.
+EVENTS_BUS = 'posts.events.CacheBus'
+EVENTS_POLL_INTERVAL = 1
+EVENTS_HOLD_SECONDS = 30
+EVENTS_MAX_STREAMS = env.int('EVENTS_MAX_STREAMS', default=16)
+
+# Сервер python manage.py serve: число процессов-воркеров, 0 - 2 * CPU + 1
+SERVE_WORKERS = env.int('WEB_CONCURRENCY', default=0)
+# Потоки на воркер; соединения сверх них ждут в очереди
+SERVE_THREADS = env.int('SERVE_THREADS', default=32)
+# Сколько секунд воркер после SIGTERM дорабатывает принятые соединения
+SERVE_GRACEFUL_TIMEOUT = 30
+# Первые страницы главной, которые serve открывает до приёма запросов
+SERVE_WARM_PAGES = 3
+
+# Фоновые задачи (приложение jobs, воркер: python manage.py run_jobs)
+JOBS_EAGER = env.bool('JOBS_EAGER', default=False)
+JOBS_MAX_ATTEMPTS = 5
+# Повтор через 10, 20, 40... секунд, но не реже чем раз в час
+JOBS_BACKOFF_BASE = 10
+JOBS_BACKOFF_MAX = 3600
+# Через сколько секунд задачу упавшего воркера можно взять снова
+JOBS_LOCK_TIMEOUT = 600
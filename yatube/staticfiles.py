@@ -0,0 +1,138 @@
+"""
+Статика с хэшем содержимого в имени и заранее сжатыми копиями.
+
+collectstatic с PrecompressedManifestStorage пишет файлы вида
+app.3f2a1b.css и рядом app.3f2a1b.css.gz (и .br, если установлен brotli).
+serve_static отдаёт сжатую копию по Accept-Encoding без сжатия на лету,
+а файлы с хэшем - с заголовком immutable на год.
+"""
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.txt', '.html', '.json',
+                           '.xml', '.ico', '.eot', '.ttf', '.otf')
+# Файлы меньше этого размера сжатие почти не уменьшает.
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Файлы без хэша в имени могут измениться при следующем деплое.
+MUTABLE_CACHE_CONTROL = 'public, max-age=3600'
+
+# Порядок - от лучшего сжатия к худшему.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def compress_gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+COMPRESSORS = {'.gz': compress_gzip}
+if brotli is not None:
+    COMPRESSORS['.br'] = compress_brotli
+
+
+def precompress(path):
+    """
+    Пишет рядом с файлом сжатые копии, если они меньше оригинала.
+    """
+    with open(path, 'rb') as source:
+        data = source.read()
+    for suffix, compress in COMPRESSORS.items():
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as target:
+                target.write(compressed)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class PrecompressedManifestStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        final_names = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                # Css обрабатывается в несколько проходов, берём последнее имя.
+                final_names[name] = hashed_name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name, hashed_name in final_names.items():
+            for compressed_name in {name, hashed_name}:
+                path = self.path(compressed_name)
+                if (compressed_name.endswith(COMPRESSIBLE_EXTENSIONS)
+                        and os.path.getsize(path) >= MIN_COMPRESS_SIZE):
+                    precompress(path)
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for item in header.split(','):
+        encoding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def is_hashed(name):
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if not hashed_files:
+        return False
+    if not hasattr(staticfiles_storage, '_hashed_names'):
+        staticfiles_storage._hashed_names = set(hashed_files.values())
+    return name in staticfiles_storage._hashed_names
+
+
+def serve_static(request, path):
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    encoding, served_path = None, full_path
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(full_path + suffix):
+            encoding, served_path = name, full_path + suffix
+            break
+
+    stat = os.stat(served_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+    content_type, _ = mimetypes.guess_type(full_path)
+    response = FileResponse(open(served_path, 'rb'),
+                            content_type=content_type or 'application/octet-stream')
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if is_hashed(path)
+                                 else MUTABLE_CACHE_CONTROL)
+    return response
@@ -0,0 +1,47 @@
+"""
+Запуск тестов: python manage.py test.
+"""
+import os
+import tempfile
+from unittest import mock
+
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Тестовая база SQLite создаётся файлом во временном каталоге, а не в
+    памяти: общая in-memory база блокирует таблицу целиком и сразу падает
+    при параллельной записи, а воркеры run_jobs в тестах пишут из своих
+    потоков. Файловая база вместо этого ждёт блокировку.
+    """
+
+    def setup_databases(self, **kwargs):
+        settings_dict = connections['default'].settings_dict
+        test_settings = settings_dict.setdefault('TEST', {})
+        # Django заранее заполняет TEST['NAME'] значением None.
+        if (settings_dict['ENGINE'] == 'django.db.backends.sqlite3'
+                and not test_settings.get('NAME')):
+            test_settings['NAME'] = os.path.join(
+                tempfile.gettempdir(), f'yatube_test_{os.getpid()}.sqlite3')
+        return super().setup_databases(**kwargs)
+
+
+class ImmediateOnCommit:
+    """
+    TestCase не фиксирует транзакцию теста, поэтому действия, отложенные
+    до фиксации (transaction.on_commit), в нём выполняются сразу.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._on_commit = mock.patch('django.db.transaction.on_commit',
+                                    lambda func, using=None: func())
+        cls._on_commit.start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._on_commit.stop()
@@ -13,12 +13,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.conf import settings
 from django.conf.urls import handler404, handler500
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.flatpages import views
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from yatube.flatpages import flatpage
+from yatube.mediafiles import serve_media
+from yatube.staticfiles import serve_static
 
 handler404 = "posts.views.page_not_found" # noqa
 handler500 = "posts.views.server_error" # noqa
@@ -27,18 +32,29 @@ urlpatterns = [
     # раздел администратора
     path("admin/", admin.site.urls),
     # flatpages
-    path("about/", include("django.contrib.flatpages.urls")),
+    path("about/<path:url>", flatpage),
     # регистрация и авторизация
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
+    # flatpages раньше posts, иначе их адреса перехватывает профиль автора
+    path('about-us/', flatpage, {'url': '/about-us/'}, name='about'),
+    path('terms/', flatpage, {'url': '/terms/'}, name='terms'),
+    path('about-spec/', flatpage, {'url': '/about-spec/'}, name='about_spec'),
+    path('about-author/', flatpage, {'url': '/about-author/'}, name='about_author'),
     # импорт из приложения posts
     path("", include('posts.urls')),
-    path('about-us/', views.flatpage, {'url': '/about-us/'}, name='about'),
-    path('terms/', views.flatpage, {'url': '/terms/'}, name='terms'),
-    path('about-spec/', views.flatpage, {'url': '/about-spec/'}, name='about_spec'),
-    path('about-author/', views.flatpage, {'url': '/about-author/'}, name='about_author'),
 ]
 
+if settings.STATIC_SERVE:
+    urlpatterns = [
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static),
+    ] + urlpatterns
+
+if settings.MEDIA_SERVE:
+    urlpatterns = [
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media),
+    ] + urlpatterns
+
 if settings.DEBUG:
     import debug_toolbar
     urlpatterns += (path('__debug__/)', include(debug_toolbar.urls)),)
@@ -0,0 +1,136 @@
+"""
+Прогрев приложения до приёма запросов (python manage.py serve).
+
+Команда serve загружает приложение и прогревает его в главном процессе,
+а воркеры получают готовое состояние через fork и делят эту память с
+ним (copy-on-write). Прогреваются:
+
+- шаблоны проекта - компилируются в кэш загрузчика (его включает сам
+  Django при выключенном DEBUG);
+- адреса - URLconf импортируется вместе с представлениями, регулярные
+  выражения компилируются, таблица reverse() строится;
+- страницы - первые страницы главной, список сообществ и flatpages
+  запрашиваются через само приложение по адресу SITE_URL. Это заполняет
+  кэш страниц, счётчики лент, словарь flatpages и открывает соединения.
+"""
+import os
+import time
+from io import BytesIO, StringIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.urls import get_resolver, reverse
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt')
+
+
+def project_template_names(loader):
+    """
+    Имена шаблонов из каталогов загрузчика внутри проекта: шаблоны
+    сторонних приложений (admin и т.п.) компилируются по первому запросу.
+    """
+    names = set()
+    for directory in loader.get_dirs():
+        directory = str(directory)
+        if not directory.startswith(settings.BASE_DIR) or not os.path.isdir(directory):
+            continue
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if file.endswith(TEMPLATE_EXTENSIONS):
+                    path = os.path.relpath(os.path.join(root, file), directory)
+                    names.add(path.replace(os.sep, '/'))
+    return names
+
+
+def warm_templates():
+    engine = engines['django'].engine
+    loaders = [loader for loader in engine.template_loaders
+               if isinstance(loader, CachedLoader)]
+    compiled = 0
+    for loader in loaders:
+        names = set()
+        for inner in loader.loaders:
+            names |= project_template_names(inner)
+        for name in sorted(names):
+            try:
+                loader.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError):
+                continue
+            compiled += 1
+    return compiled
+
+
+def warm_urls():
+    resolver = get_resolver()
+    # reverse_dict строит таблицы всего URLconf, включая include().
+    return len(resolver.reverse_dict)
+
+
+def warm_up_paths():
+    index = reverse('index')
+    paths = [index]
+    paths += [f'{index}?page={page}' for page in range(2, settings.SERVE_WARM_PAGES + 1)]
+    paths.append(reverse('group_index'))
+    paths += FlatPage.objects.filter(
+        sites=settings.SITE_ID, registration_required=False
+    ).values_list('url', flat=True)
+    return paths
+
+
+def request_environ(path):
+    site = urlsplit(settings.SITE_URL)
+    path, _, query = path.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': site.hostname,
+        'SERVER_PORT': str(site.port or (443 if site.scheme == 'https' else 80)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': site.netloc,
+        'wsgi.url_scheme': site.scheme,
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': StringIO(),
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+
+def warm_pages(application):
+    """
+    Запрашивает страницы анонимным посетителем, возвращает число
+    страниц, ответивших 200.
+    """
+    warmed = 0
+    for path in warm_up_paths():
+        statuses = []
+        body = application(request_environ(path),
+                           lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for _ in body:
+                pass
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        if statuses and statuses[0].startswith('200'):
+            warmed += 1
+    return warmed
+
+
+def warm_up(application):
+    """
+    Прогревает приложение, возвращает [(что, сколько, секунд), ...].
+    """
+    report = []
+    for name, warm in (('шаблонов', warm_templates), ('адресов', warm_urls),
+                       ('страниц', lambda: warm_pages(application))):
+        started = time.monotonic()
+        count = warm()
+        report.append((name, count, time.monotonic() - started))
+    return report